@@ -0,0 +1,125 @@
+import numpy as np
+
+# the rules of env.py for a whole batch of grids at once
+# boards are (B, N, N) uint8 arrays of log2 exponents (0 is an empty cell) and actions follow MAPPINGS (left, right, up, down)
+
+WIN_EXPONENT = 11 # 2048 tile
+
+# tile values of exponent boards (a batch or a single grid)
+def to_values(boards):
+    return np.where(boards, np.left_shift(1, boards.astype(np.int64)), 0)
+
+# log2 exponents of tile value grids (a batch or a single grid, empty cells are 0)
+def to_exponents(grids):
+    exps = np.frexp(np.asarray(grids, dtype=np.float64))[1] - 1
+    return np.maximum(exps, 0).astype(np.uint8)
+
+# pushes the tiles of every row to the right keeping their order
+def compact(rows):
+    order = np.argsort(rows != 0, axis=1, kind="stable") # empty cells first, tiles after in their original order
+    return np.take_along_axis(rows, order, axis=1)
+
+# moves every row to the right (same as shift -> combine -> shift), returns the new rows and the score gained per row
+def merge_right(rows):
+    rows = compact(rows)
+    score = np.zeros(len(rows), dtype=np.int64)
+    # combine pairs starting from the right edge (a merged cell leaves an empty cell so it can't merge twice)
+    for j in range(rows.shape[1] - 1, 0, -1):
+        merge = (rows[:, j] != 0) & (rows[:, j] == rows[:, j - 1])
+        rows[merge, j] += 1
+        rows[merge, j - 1] = 0
+        score[merge] += np.left_shift(1, rows[merge, j].astype(np.int64))
+    return compact(rows), score
+
+# every board after one move (no new tile) and the score gained per board
+def move(boards, action):
+    n_boards, size = boards.shape[:2]
+    # orient the move as a move to the right, then undo the orientation
+    if action == 0:
+        oriented = boards[:, :, ::-1]
+    elif action == 1:
+        oriented = boards
+    elif action == 2:
+        oriented = boards.transpose(0, 2, 1)[:, :, ::-1]
+    else:
+        oriented = boards.transpose(0, 2, 1)
+    rows, scores = merge_right(oriented.reshape(-1, size))
+    rows = rows.reshape(n_boards, size, size)
+
+    if action == 0:
+        after = rows[:, :, ::-1]
+    elif action == 1:
+        after = rows
+    elif action == 2:
+        after = rows[:, :, ::-1].transpose(0, 2, 1)
+    else:
+        after = rows.transpose(0, 2, 1)
+    return after, scores.reshape(n_boards, size).sum(axis=1)
+
+# the grids after each of the four moves (no new tile), their scores and if they moved, shapes (4, B, N, N), (4, B), (4, B)
+def afterstates(boards):
+    n_boards, size = boards.shape[:2]
+    # orient every move as a move to the right and stack them into one big batch of rows
+    oriented = np.stack([boards[:, :, ::-1], boards, boards.transpose(0, 2, 1)[:, :, ::-1], boards.transpose(0, 2, 1)])
+    rows, scores = merge_right(oriented.reshape(-1, size))
+    rows = rows.reshape(4, n_boards, size, size)
+
+    # undo the orientation
+    after = np.empty_like(rows)
+    after[0] = rows[0][:, :, ::-1]
+    after[1] = rows[1]
+    after[2] = rows[2][:, :, ::-1].transpose(0, 2, 1)
+    after[3] = rows[3].transpose(0, 2, 1)
+
+    moved = np.any(after != boards[None], axis=(2, 3))
+    return after, scores.reshape(4, n_boards, size).sum(axis=2), moved
+
+# adds a random tile (2 or 4, or always 2 for starting tiles) to an empty cell of the selected boards
+def populate(boards, rng, mask=None, start=False):
+    n_boards = len(boards)
+    mask = np.ones(n_boards, dtype=bool) if mask is None else mask
+    empty = (boards == 0).reshape(n_boards, -1)
+    count = empty.sum(axis=1)
+    mask = mask & (count > 0)
+
+    # pick the k-th empty cell of every board
+    k = np.floor(rng.random(n_boards) * count).astype(np.int64)
+    cell = np.argmax(np.cumsum(empty, axis=1) > k[:, None], axis=1)
+    tile = np.ones(n_boards, dtype=np.uint8) if start else rng.integers(1, 3, n_boards, dtype=np.uint8)
+
+    flat = boards.reshape(n_boards, -1)
+    rows = np.flatnonzero(mask)
+    flat[rows, cell[rows]] = tile[rows]
+    return boards
+
+# indicates which games are over (same rules as env.game_over)
+def game_over(boards):
+    full = ~np.any(boards == 0, axis=(1, 2))
+    won = np.any(boards == WIN_EXPONENT, axis=(1, 2))
+    horizontal = np.any(boards[:, :, 1:] == boards[:, :, :-1], axis=(1, 2))
+    vertical = np.any(boards[:, 1:, :] == boards[:, :-1, :], axis=(1, 2))
+    return full & (won | (~horizontal & ~vertical))
+
+# finds the goal space of every board (same quadrant priority as env.find_goal_space), returns the quadrant index
+# 0: top-left, 1: bot-left, 2: top-right, 3: bot-right
+def find_goal_space(boards):
+    size = boards.shape[1]
+    half = size // 2
+    is_max = boards == boards.max(axis=(1, 2), keepdims=True)
+    quadrants = np.stack([is_max[:, :half, :half].any(axis=(1, 2)), is_max[:, half:, :half].any(axis=(1, 2)),
+                          is_max[:, :half, half:].any(axis=(1, 2)), is_max[:, half:, half:].any(axis=(1, 2))], axis=1)
+    return np.argmax(quadrants, axis=1)
+
+# valid moves per board, -1 for moves that don't change the grid (same layout as env.find_valid_moves)
+def find_valid_moves(moved):
+    return np.where(moved.T, np.arange(4), -1)
+
+# scoring moves per board (same ordering as env.score_maximizer), shape (B, 3)
+def score_maximizer(slide_x, slide_y, scores):
+    n_boards = len(slide_x)
+    actions = np.stack([slide_x, slide_y, np.where(slide_y == 3, 2, 3)], axis=1)
+    gained = scores.T[np.arange(n_boards)[:, None], actions]
+    order = np.argsort(-gained, axis=1, kind="stable") # highest score first, ties keep their order
+    gained = np.take_along_axis(gained, order, axis=1)
+    actions = np.take_along_axis(actions, order, axis=1)
+    return np.where(gained > 0, actions, -1)
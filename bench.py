@@ -0,0 +1,178 @@
+import argparse
+import json
+import platform
+import sys
+import time
+import numpy as np
+import env
+from env import Env2048, MAPPINGS
+from grid import Grid
+from observations import model_mode
+from vec_env import VecEnv2048
+
+# micro benchmarks (game rules) and macro benchmarks (env steps, agent inference) for every grid size
+# python bench.py --json results.json                  save results
+# python bench.py --baseline results.json              compare against saved results (exit code 1 on regressions)
+
+SIZES = [4, 5, 6, 7]
+ENGINES = ["numpy", "table", "bitboard"]
+PERCENTILES = [50, 90, 99]
+VEC_ENVS = 256 # boards per VecEnv2048 step
+
+# mid game grids for a size (random games stopped at random points), so rules see realistic boards
+def sample_grids(size, count=64, seed=0):
+    rng = np.random.default_rng(seed)
+    game = Env2048(size, engine="table", seed=seed)
+    grids = []
+    while len(grids) < count:
+        game.reset()
+        for _ in range(rng.integers(5, 30 * size)):
+            obs, reward, done, info = game.step(rng.integers(4))
+            if done:
+                break
+        grids.append(np.array(game.grid, dtype=float))
+    return grids
+
+# calls fn(i) for i = 0..calls-1 (after a warmup), returns the latency of every call in nanoseconds
+# setup(i) runs before each call outside the timed region (e.g. restarting a finished game)
+def time_calls(fn, calls, setup=None):
+    for i in range(min(calls, 10)):
+        if setup:
+            setup(i)
+        fn(i)
+    latencies = np.empty(calls, dtype=np.int64)
+    clock = time.perf_counter_ns
+    for i in range(calls):
+        if setup:
+            setup(i)
+        start = clock()
+        fn(i)
+        latencies[i] = clock() - start
+    return latencies
+
+# summary of a benchmark (items is how many steps one call makes, e.g. the boards of a batched step)
+def summarize(latencies, items=1):
+    return dict(calls=len(latencies), steps_per_sec=items * 1e9 / latencies.mean(), mean_us=latencies.mean() / 1000,
+                **{f"p{p}_us": float(np.percentile(latencies, p)) / 1000 for p in PERCENTILES})
+
+# every benchmark for a grid size, returns {name: callable(i)}, {name: items per call} and {name: untimed setup(i)}
+def benchmarks(size, engines, model=None):
+    grids = sample_grids(size)
+    pick = lambda i: grids[i % len(grids)]
+    direction = lambda i: MAPPINGS[i % 4]
+    cases, items, setups = {}, {}, {}
+
+    # rules from env.py
+    cases["shift"] = lambda i: env.shift(pick(i), size=size)
+    cases["combine"] = lambda i: env.combine(env.shift(pick(i), size=size), size=size) # includes the shift it needs
+    cases["game_over"] = lambda i: env.game_over(pick(i), size=size)
+    for engine in engines:
+        if engine == "bitboard" and size != 4:
+            continue
+        cases[f"move[{engine}]"] = lambda i, engine=engine: env.move(pick(i).copy(), direction(i), size=size, engine=engine)
+        cases[f"find_valid_moves[{engine}]"] = lambda i, engine=engine: env.find_valid_moves(pick(i), size, engine=engine)
+        cases[f"score_maximizer[{engine}]"] = lambda i, engine=engine: env.score_maximizer(0, 2, pick(i), size, engine=engine)
+
+        # env reset / step (steps on a live game, finished games restart outside the timed call)
+        game = Env2048(size, engine=engine, seed=0)
+        game.reset()
+        cases[f"Env2048.reset[{engine}]"] = lambda i, game=game: game.reset()
+        stepper = Env2048(size, engine=engine, seed=1)
+        stepper.reset()
+        cases[f"Env2048.step[{engine}]"] = lambda i, stepper=stepper: stepper.step(i % 4)
+        setups[f"Env2048.step[{engine}]"] = lambda i, stepper=stepper: stepper.reset() if stepper.done else None
+
+        # manual play grid (finished games restart outside the timed call too)
+        board = Grid(size, engine=engine, seed=0)
+        cases[f"Grid.move[{engine}]"] = lambda i, board=board: board.move(direction(i))
+        setups[f"Grid.move[{engine}]"] = lambda i, board=board: board.__init__(size, engine=board.engine) if board.game_over() else None
+
+    # batched env
+    vec = VecEnv2048(VEC_ENVS, size=size, seed=0)
+    vec.reset()
+    actions = np.random.default_rng(0).integers(0, 4, (16, VEC_ENVS))
+    cases["VecEnv2048.step"] = lambda i: vec.step(actions[i % 16])
+    items["VecEnv2048.step"] = VEC_ENVS
+
+    # agent inference on the observation it was trained with, or on the grid for agents that play from the board
+    if model is not None:
+        mode = "features" if getattr(model, "uses_board", False) else model_mode(model, size)
+        observations = grids[:16] if getattr(model, "uses_board", False) else [Env2048(size, seed=i, observation_mode=mode).reset() for i in range(16)]
+        cases["predict"] = lambda i: model.predict(observations[i % 16], deterministic=True)
+        batch_obs = np.stack(observations * 16)
+        cases["predict[batch=256]"] = lambda i: model.predict(batch_obs, deterministic=True)
+        items["predict[batch=256]"] = len(batch_obs)
+
+    return cases, items, setups
+
+# runs the selected benchmarks, returns {name: {size: summary}}
+def run(sizes=SIZES, engines=ENGINES, calls=2000, only=None, model=None):
+    results = {}
+    for size in sizes:
+        cases, items, setups = benchmarks(size, engines, model=model)
+        for name, fn in cases.items():
+            if only and not any(name.startswith(prefix) for prefix in only):
+                continue
+            results.setdefault(name, {})[str(size)] = summarize(time_calls(fn, calls, setups.get(name)), items.get(name, 1))
+    return results
+
+# relative change of steps/sec against a baseline, returns [(name, size, baseline, current, change)]
+def compare(results, baseline):
+    rows = []
+    for name, sizes in results.items():
+        for size, summary in sizes.items():
+            old = baseline.get(name, {}).get(size)
+            if old is not None:
+                rows.append((name, size, old["steps_per_sec"], summary["steps_per_sec"],
+                             summary["steps_per_sec"] / old["steps_per_sec"] - 1))
+    return rows
+
+def format_results(results):
+    lines = [f"{'benchmark':<32}{'size':>5}{'steps/s':>14}" + "".join(f"{f'p{p} us':>11}" for p in PERCENTILES)]
+    for name, sizes in results.items():
+        for size, summary in sizes.items():
+            lines.append(f"{name:<32}{size:>5}{summary['steps_per_sec']:>14,.0f}" +
+                         "".join(f"{summary[f'p{p}_us']:>11.1f}" for p in PERCENTILES))
+    return "\n".join(lines)
+
+def format_comparison(rows, tolerance):
+    lines = [f"{'benchmark':<32}{'size':>5}{'baseline/s':>14}{'current/s':>14}{'change':>9}"]
+    for name, size, old, new, change in rows:
+        flag = "  REGRESSION" if change < -tolerance else ""
+        lines.append(f"{name:<32}{size:>5}{old:>14,.0f}{new:>14,.0f}{change:>+9.1%}{flag}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="benchmark the 2048 game rules, envs and agent inference")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--engines", nargs="+", default=ENGINES, choices=ENGINES)
+    parser.add_argument("--calls", type=int, default=2000, help="timed calls per benchmark")
+    parser.add_argument("--only", nargs="+", help="benchmark name prefixes to run, e.g. move Env2048.step")
+    parser.add_argument("--model", help="agent checkpoint for the predict benchmarks, e.g. Agents/Agent-2940")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="compare against results saved with --json")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="slowdown counted as a regression (0.1 = 10%%)")
+    args = parser.parse_args()
+
+    model = None
+    if args.model:
+        from evaluate import load_model
+        model = load_model(args.model)
+
+    results = run(sizes=args.sizes, engines=args.engines, calls=args.calls, only=args.only, model=model)
+    print(format_results(results))
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(dict(machine=platform.platform(), python=platform.python_version(), numpy=np.__version__,
+                           results=results), file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)["results"]
+        rows = compare(results, baseline)
+        print()
+        print(format_comparison(rows, args.tolerance))
+        if any(change < -args.tolerance for *_, change in rows):
+            sys.exit(1)
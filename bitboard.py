@@ -0,0 +1,187 @@
+import numpy as np
+
+# 4x4 grids packed into one 64-bit integer, each cell holds the log2 exponent of its tile in 4 bits
+# cell (row, col) sits at bits 4 * (4 * row + col), so every row is a 16-bit chunk with its leftmost tile in the low nibble
+
+ACTIONS = {"left": 0, "right": 1, "up": 2, "down": 3}
+ROW_MASK = 0xFFFF
+MAX_TILE = 1 << 15 # tiles must stay below this so merges still fit in a nibble
+SHIFTS = np.arange(0, 64, 4, dtype=np.uint64) # bit offset of every cell (row major)
+
+_TABLES = None
+
+# merges a row of exponents exactly like shift -> combine -> shift does for a move to the right
+def merge_row(exps):
+    tiles = [exp for exp in exps if exp][::-1] # non empty tiles, closest to the right edge first
+    merged = []
+    score = 0
+    i = 0
+    # combine pairs starting from the edge the tiles move towards
+    while i < len(tiles):
+        if i + 1 < len(tiles) and tiles[i] == tiles[i + 1]:
+            merged.append(tiles[i] + 1)
+            score += 1 << (tiles[i] + 1)
+            i += 2
+        else:
+            merged.append(tiles[i])
+            i += 1
+
+    return [0] * (len(exps) - len(merged)) + merged[::-1], score
+
+# packs a list of 4 exponents into a 16-bit row
+def pack_row(exps):
+    row = 0
+    for col, exp in enumerate(exps):
+        row |= min(exp, 15) << (4 * col)
+    return row
+
+# spreads a 16-bit row into a column (nibble k goes to row k)
+def unpack_col(row):
+    col = 0
+    for k in range(4):
+        col |= ((row >> (4 * k)) & 0xF) << (16 * k)
+    return col
+
+# builds the 65,536 entry row tables (left/right results, their scores and column versions for up/down)
+def build_tables():
+    global _TABLES
+
+    if _TABLES is not None:
+        return _TABLES
+
+    row_left, row_right = [0] * 65536, [0] * 65536
+    score_left, score_right = [0] * 65536, [0] * 65536
+    col_left, col_right = [0] * 65536, [0] * 65536
+
+    for row in range(65536):
+        exps = [(row >> (4 * col)) & 0xF for col in range(4)]
+        right, score_right[row] = merge_row(exps)
+        left, score_left[row] = merge_row(exps[::-1]) # left is a right move on the reversed row
+        row_right[row] = pack_row(right)
+        row_left[row] = pack_row(left[::-1])
+        col_right[row] = unpack_col(row_right[row])
+        col_left[row] = unpack_col(row_left[row])
+
+    _TABLES = dict(row_left=row_left, row_right=row_right, score_left=score_left, score_right=score_right,
+                   col_left=col_left, col_right=col_right)
+    # numpy copies for moving many boards at once
+    _TABLES.update({f"np_{key}": np.array(value, dtype=np.uint64) for key, value in list(_TABLES.items())})
+    return _TABLES
+
+# swaps rows and columns of a packed board
+def transpose(board):
+    a1 = board & 0xF0F00F0FF0F00F0F
+    a2 = board & 0x0000F0F00000F0F0
+    a3 = board & 0x0F0F00000F0F0000
+    a = a1 | (a2 << 12) | (a3 >> 12)
+    b1 = a & 0xFF00FF0000FF00FF
+    b2 = a & 0x00FF00FF00000000
+    b3 = a & 0x00000000FF00FF00
+    return b1 | (b2 >> 24) | (b3 << 24)
+
+# transpose for an array of packed boards (numpy needs uint64 masks and shifts)
+def transpose_boards(boards):
+    u = np.uint64
+    a1 = boards & u(0xF0F00F0FF0F00F0F)
+    a2 = boards & u(0x0000F0F00000F0F0)
+    a3 = boards & u(0x0F0F00000F0F0000)
+    a = a1 | (a2 << u(12)) | (a3 >> u(12))
+    b1 = a & u(0xFF00FF0000FF00FF)
+    b2 = a & u(0x00FF00FF00000000)
+    b3 = a & u(0x00000000FF00FF00)
+    return b1 | (b2 >> u(24)) | (b3 << u(24))
+
+# packs a 4x4 grid of log2 exponents (below 16) into a 64-bit integer, two cells per byte little endian
+def pack(exps):
+    cells = np.asarray(exps, dtype=np.uint8).ravel()
+    return int.from_bytes((cells[0::2] | (cells[1::2] << 4)).tobytes(), "little")
+
+# unpacks a 64-bit board into a 4x4 uint8 grid of log2 exponents
+def unpack(board):
+    packed = np.frombuffer(int(board).to_bytes(8, "little"), dtype=np.uint8)
+    exps = np.empty(16, dtype=np.uint8)
+    exps[0::2] = packed & 0xF
+    exps[1::2] = packed >> 4
+    return exps.reshape(4, 4)
+
+# packs a 4x4 grid of tile values into a 64-bit integer
+def encode(grid):
+    exps = np.frexp(np.asarray(grid, dtype=np.float64))[1] - 1 # log2 of a power of two, empty cells give -1
+    return pack(np.maximum(exps, 0))
+
+# unpacks a 64-bit board back into a 4x4 grid of tile values
+def decode(board):
+    exps = unpack(board)
+    return np.where(exps, np.left_shift(1, exps.astype(np.int64)), 0)
+
+# indicates if every tile of the grid can be packed and merged without overflowing
+def fits(grid):
+    return np.max(grid) < MAX_TILE
+
+# moves a packed board (0: left, 1: right, 2: up, 3: down), returns the new board and the score gained
+def move_board(board, action):
+    tables = _TABLES or build_tables()
+    result = 0
+    score = 0
+
+    # horizontal moves work on rows directly
+    if action < 2:
+        rows = tables["row_left"] if action == 0 else tables["row_right"]
+        scores = tables["score_left"] if action == 0 else tables["score_right"]
+        for shift in (0, 16, 32, 48):
+            row = (board >> shift) & ROW_MASK
+            result |= rows[row] << shift
+            score += scores[row]
+
+    # vertical moves read columns as rows of the transposed board and write them back as columns
+    else:
+        cols = tables["col_left"] if action == 2 else tables["col_right"]
+        scores = tables["score_left"] if action == 2 else tables["score_right"]
+        board_t = transpose(board)
+        for col in range(4):
+            row = (board_t >> (16 * col)) & ROW_MASK
+            result |= cols[row] << (4 * col)
+            score += scores[row]
+
+    return result, score
+
+# moves an array of packed boards in one go, returns the new boards and the scores gained
+def move_boards(boards, action):
+    tables = _TABLES or build_tables()
+    boards = np.asarray(boards, dtype=np.uint64)
+    result = np.zeros_like(boards)
+    score = np.zeros(boards.shape, dtype=np.uint64)
+    mask = np.uint64(ROW_MASK)
+
+    if action < 2:
+        rows = tables["np_row_left"] if action == 0 else tables["np_row_right"]
+        scores = tables["np_score_left"] if action == 0 else tables["np_score_right"]
+        for shift in (0, 16, 32, 48):
+            row = (boards >> np.uint64(shift)) & mask
+            result |= rows[row] << np.uint64(shift)
+            score += scores[row]
+    else:
+        cols = tables["np_col_left"] if action == 2 else tables["np_col_right"]
+        scores = tables["np_score_left"] if action == 2 else tables["np_score_right"]
+        boards_t = transpose_boards(boards)
+        for col in range(4):
+            row = (boards_t >> np.uint64(16 * col)) & mask
+            result |= cols[row] << np.uint64(4 * col)
+            score += scores[row]
+
+    return result, score.astype(np.int64)
+
+# same result as env.slide for a 4x4 grid (the grid after the move and the score gained, no new tile)
+def slide(grid, direction):
+    board = encode(grid)
+    result, score = move_board(board, ACTIONS[direction])
+    return decode(result), score
+
+# same result as slide for all four moves (left, right, up, down), packing the grid only once
+def slide_all(grid):
+    board = encode(grid)
+    slides = []
+    for action in range(4):
+        result, score = move_board(board, action)
+        slides.append((decode(result), score))
+    return slides
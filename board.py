@@ -0,0 +1,101 @@
+import numpy as np
+import batch
+import bitboard
+import rows
+
+# one 2048 board shared by Grid, Env2048 and the GUI
+# cells are log2 exponents in a (size, size) uint8 array (0 is an empty cell), the same layout as batch.py and recorder.py,
+# so a 4x4 board is 16 bytes instead of the 128 of an int64 grid of tile values
+# tile values are only built when something asks for them (board.values, cached until the board changes)
+# boards that were moved to are never changed again (moves return new boards), so they can be shared without copying
+
+SIZES = range(4, 8) # 4x4 to 7x7
+DIRECTIONS = ("left", "right", "up", "down") # action order of env.MAPPINGS
+VALUES = np.concatenate([[0], np.left_shift(1, np.arange(1, 63, dtype=np.int64))]) # tile value of every exponent
+
+# the exponents after one move (no new tile) and the score gained
+def move(exps, action, engine="numpy"):
+
+    # 4x4 boards can use the packed board row tables (as long as no tile could overflow a nibble)
+    if engine == "bitboard" and exps.max() < 15:
+        board, score = bitboard.move_board(bitboard.pack(exps), action)
+        return bitboard.unpack(board), score
+    # any size can use the lazily filled row transition cache
+    if engine == "table":
+        return rows.merge(exps, DIRECTIONS[action])
+
+    after, scores = batch.move(exps[None], action)
+    return after[0], int(scores[0])
+
+
+class Board:
+
+    def __init__(self, size=4, exps=None):
+        if size not in SIZES:
+            raise ValueError(f"boards are 4x4 to 7x7, not {size}x{size}")
+        self.size = size
+        self.exps = np.zeros((size, size), dtype=np.uint8) if exps is None else np.array(exps, dtype=np.uint8)
+        self.cached = None # tile values of the current exponents
+
+    # tile values (int64, read only), built on first use
+    @property
+    def values(self):
+        if self.cached is None:
+            self.cached = VALUES[self.exps]
+            self.cached.flags.writeable = False
+        return self.cached
+
+    # adds random tiles (n_tiles=2 are the starting tiles, always 2), returns the cell and exponent of the last one
+    # one draw for the cell and one for the tile (none for starting tiles), seeded games play out the same as before
+    def populate(self, rng, n_tiles=1):
+        for _ in range(n_tiles):
+            empty = np.flatnonzero(self.exps == 0) # empty spaces (flat index)
+            cell = int(empty[rng.integers(len(empty))]) # random spot
+            exp = 1 if n_tiles == 2 or rng.random() < 0.5 else 2 # a 2 or a 4
+            self.exps.flat[cell] = exp
+        self.cached = None
+        return cell, exp
+
+    # the board after a move (0: left, 1: right, 2: up, 3: down), the score gained and if the move changed the board
+    def slide(self, action, engine="numpy"):
+        exps, score = move(self.exps, action, engine=engine)
+        return Board(self.size, exps), score, int(not np.array_equal(exps, self.exps))
+
+    # slide for every move (left, right, up, down)
+    def afterstates(self, engine="numpy"):
+
+        # packed boards and numpy batches do all four moves from one conversion
+        if engine == "bitboard" and self.exps.max() < 15:
+            board = bitboard.pack(self.exps)
+            slides = [bitboard.move_board(board, action) for action in range(4)]
+            return [(Board(4, bitboard.unpack(after)), score, int(after != board)) for after, score in slides]
+        if engine != "table":
+            after, scores, moved = batch.afterstates(self.exps[None])
+            return [(Board(self.size, after[action, 0]), int(scores[action, 0]), int(moved[action, 0])) for action in range(4)]
+
+        return [self.slide(action, engine=engine) for action in range(4)]
+
+    # no empty cell and no two equal neighbours (stop_at_win also ends a full board with a 2048 tile, like env.game_over)
+    def game_over(self, stop_at_win=False):
+        exps = self.exps
+        if not exps.all():
+            return False
+        if stop_at_win and self.won():
+            return True
+        return not np.any(exps[:, 1:] == exps[:, :-1]) and not np.any(exps[1:] == exps[:-1])
+
+    # a 2048 tile is on the board
+    def won(self):
+        return bool(np.any(self.exps == batch.WIN_EXPONENT))
+
+    def max_tile(self):
+        return int(VALUES[self.exps.max()])
+
+    def copy(self):
+        return Board(self.size, self.exps)
+
+    def __eq__(self, other):
+        return isinstance(other, Board) and np.array_equal(self.exps, other.exps)
+
+    def __str__(self):
+        return str(self.values)
@@ -0,0 +1,131 @@
+import copy
+import io
+import json
+import os
+import queue
+import threading
+from collections import deque
+import numpy as np
+
+# checkpoints written on a background thread, the learner only copies the model's parameters and attributes (snapshot)
+# and the thread builds the zip (same file as model.save), writes it and evaluates it
+# keeps the last keep_last checkpoints plus every keep_every-th one, the rest are deleted once newer ones are written
+# eval_every > 0 scores every eval_every-th checkpoint over a few games (with the numpy policy from policy.py, so it's
+# cheap) and keeps the best one as <name>-best.zip next to <name>-best.json
+
+class Checkpointer(threading.Thread):
+
+    def __init__(self, name, directory="models", keep_last=5, keep_every=100, eval_every=0, eval_games=200, size=4, seed=0):
+        threading.Thread.__init__(self, daemon=True)
+        self.name = name
+        self.directory = directory
+        self.keep_last = keep_last
+        self.keep_every = keep_every # 0 keeps only the last ones
+        self.eval_every = eval_every
+        self.eval_games = eval_games
+        self.size = size
+        self.seed = seed # every evaluation plays the same games
+        self.snapshots = queue.Queue() # (step, snapshot), None stops the thread
+        self.written = [] # steps written by this checkpointer that are still on disk, oldest first
+        self.count = 0 # checkpoints written so far (sets the evaluation cadence, retention doesn't touch it)
+        self.best = None # (score, step)
+        self.error = None
+        os.makedirs(directory, exist_ok=True)
+
+        # a best checkpoint from an earlier run has to be beaten
+        best_path = os.path.join(directory, f"{name}-best.json")
+        if eval_every and os.path.exists(best_path):
+            with open(best_path) as file:
+                best = json.load(file)
+            self.best = (best["score"], best["step"])
+        self.start()
+
+    def path(self, step):
+        return os.path.join(self.directory, f"{self.name}-{step}.zip")
+
+    # snapshots the model and queues it for writing (the learner can keep training right away)
+    def save(self, model, step):
+        if self.error is not None:
+            raise RuntimeError(f"checkpoint writer failed: {self.error}")
+        self.snapshots.put((step, snapshot(model)))
+
+    # waits for every queued checkpoint to be written
+    def close(self):
+        self.snapshots.put(None)
+        self.join()
+        if self.error is not None:
+            raise RuntimeError(f"checkpoint writer failed: {self.error}")
+
+    def run(self):
+        while True:
+            snapshot = self.snapshots.get()
+            if snapshot is None:
+                return
+            try:
+                self.write(*snapshot)
+            except Exception as error:
+                self.error = error
+
+    def write(self, step, snapshot):
+        data = serialize(*snapshot)
+        write_file(self.path(step), data)
+        self.written.append(step)
+        self.count += 1
+
+        if self.eval_every and self.count % self.eval_every == 0:
+            self.evaluate(step, data)
+
+        # retention: every checkpoint except the last few and every keep_every-th goes
+        for old in self.written[:-self.keep_last] if self.keep_last else self.written:
+            if not (self.keep_every and old % self.keep_every == 0) and os.path.exists(self.path(old)):
+                os.remove(self.path(old))
+        self.written = [old for old in self.written if os.path.exists(self.path(old))]
+
+    # mean score over the same seeded games, the best checkpoint so far is copied to <name>-best.zip
+    def evaluate(self, step, data):
+        from evaluate import play_games
+        from policy import NumpyPolicy, policy_arrays
+
+        model = NumpyPolicy.from_arrays(policy_arrays(io.BytesIO(data)))
+        stats = play_games(model, games=self.eval_games, size=self.size, seed=self.seed, deterministic=True)
+        score = float(np.mean(stats["score"]))
+
+        if self.best is None or score > self.best[0]:
+            self.best = (score, step)
+            write_file(os.path.join(self.directory, f"{self.name}-best.zip"), data)
+            write_file(os.path.join(self.directory, f"{self.name}-best.json"),
+                       json.dumps(dict(step=step, score=score, games=self.eval_games)).encode())
+
+# what model.save writes (attributes, parameter and optimizer state dicts, torch variables), copied on the learner thread
+# tensors are cloned and containers the learner keeps changing (episode info deques, last observations) are copied
+def snapshot(model):
+    state_dicts, torch_variables = model._get_torch_save_params()
+    torch_variables = torch_variables or []
+    exclude = set(model._excluded_save_params()) | {name.split(".")[0] for name in state_dicts + torch_variables}
+
+    data = {}
+    for key, value in model.__dict__.items():
+        if key not in exclude:
+            data[key] = copy.copy(value) if isinstance(value, (list, dict, deque, np.ndarray)) else value
+
+    variables = {}
+    for name in torch_variables:
+        attr = model
+        for part in name.split("."):
+            attr = getattr(attr, part)
+        variables[name] = attr
+    return data, copy.deepcopy(model.get_parameters()), copy.deepcopy(variables) or None
+
+# the checkpoint zip of a snapshot (same bytes layout as model.save)
+def serialize(data, params, variables):
+    from stable_baselines3.common.save_util import save_to_zip_file
+
+    buffer = io.BytesIO()
+    save_to_zip_file(buffer, data=data, params=params, pytorch_variables=variables)
+    return buffer.getvalue()
+
+# replaces a file in one step, a crash mid write never leaves a broken checkpoint behind
+def write_file(path, data):
+    with open(f"{path}.tmp", "wb") as file:
+        file.write(data)
+    os.replace(f"{path}.tmp", path)
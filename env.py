@@ -1,11 +1,16 @@
 import gym
 import numpy as np
-from stable_baselines3.common.env_checker import check_env
 from gym import spaces
+import bitboard
+import rows
+from board import Board
+from observations import encode, observation_space
+from recorder import NO_SPAWN
 
 MAPPINGS = {0: "left", 1: "right", 2: "up", 3: "down"}
 
 # adds a random tiles to grid, or initializes grid with starting tiles
+# (Env2048 and Grid draw new tiles from their own random source with board.Board.populate)
 def populate(grid, n_tiles=1):
     for _ in range(n_tiles):
         row, col = np.where(grid == 0) # empty spaces
@@ -22,9 +27,39 @@ def populate(grid, n_tiles=1):
 
     return grid
 
+# pre-generated spawn draws that stand in for a Generator in board.Board.populate
+# the k-th spawn of every game from the same seed uses the same draws, so agents can be compared on identical tile sequences
+class SpawnStream:
+
+    def __init__(self, seed=None, chunk=4096):
+        cell_seed, tile_seed = np.random.SeedSequence(seed).spawn(2) # separate streams so cells and tiles never shift each other
+        self.cell_rng = np.random.default_rng(cell_seed)
+        self.tile_rng = np.random.default_rng(tile_seed)
+        self.chunk = chunk
+        self.cells = self.cell_rng.random(chunk) # fraction of the empty cells to skip
+        self.tiles = self.tile_rng.random(chunk) # below 0.5 is a 2, otherwise a 4
+        self.cell_index = 0
+        self.tile_index = 0
+
+    # random spot among high empty cells
+    def integers(self, high):
+        if self.cell_index == len(self.cells):
+            self.cells = np.concatenate([self.cells, self.cell_rng.random(self.chunk)])
+        cell = self.cells[self.cell_index]
+        self.cell_index += 1
+        return int(cell * high)
+
+    # uniform draw for the tile value
+    def random(self):
+        if self.tile_index == len(self.tiles):
+            self.tiles = np.concatenate([self.tiles, self.tile_rng.random(self.chunk)])
+        tile = self.tiles[self.tile_index]
+        self.tile_index += 1
+        return tile
+
 # moves tiles to rightmost
 def shift(matrix, size=4):
-        new_matrix = np.zeros((size, size)) 
+        new_matrix = np.zeros((size, size), dtype=np.asarray(matrix).dtype) # keeps the grid's dtype
         # iterate rows and tiles
         for i, row in enumerate(matrix): 
             fill = size - 1
@@ -48,8 +83,8 @@ def combine(matrix, size=4):
 
     return matrix, score
 
-# moves tiles in grid based on direction
-def move(grid, direction, size=4):
+# slides tiles in grid based on direction, returns the new grid and the score gained (no new tile is added)
+def slide(grid, direction, size=4):
 
     matrix = grid
 
@@ -80,9 +115,42 @@ def move(grid, direction, size=4):
         matrix, score = combine(matrix, size=size) # combine like tiles
         matrix = shift(matrix, size=size) # push tiles to the rightmost
         matrix = np.rot90(matrix, 3) # rotate the matrix 270 degrees counter-clockwise to get back to the original orientation
+
+    return matrix, score
+
+# the grid after a move (no new tile), the score gained and if the move changed the grid
+def afterstate(grid, direction, size=4, engine="numpy"):
+
+    # 4x4 grids can use the packed board row tables (as long as no tile could overflow a nibble)
+    if engine == "bitboard" and bitboard.fits(grid):
+        matrix, score = bitboard.slide(grid, direction)
+    # any size can use the lazily filled row transition cache
+    elif engine == "table":
+        matrix, score = rows.slide(grid, direction)
+    else:
+        matrix, score = slide(grid, direction, size=size)
+
+    return matrix, score, int(not np.array_equal(matrix, grid))
+
+# afterstates for every move (left, right, up, down), computed once per state and shared by the helpers below
+def afterstates(grid, size=4, engine="numpy"):
+
+    # packed engines convert the grid once for all four moves
+    if engine == "bitboard" and bitboard.fits(grid):
+        slides = bitboard.slide_all(grid)
+    elif engine == "table":
+        slides = rows.slide_all(grid)
+    else:
+        slides = [slide(grid, MAPPINGS[action], size=size) for action in range(4)]
+
+    return [(matrix, score, int(not np.array_equal(matrix, grid))) for matrix, score in slides]
+
+# moves tiles in grid based on direction
+def move(grid, direction, size=4, engine="numpy"):
+    matrix, score, moved = afterstate(grid, direction, size=size, engine=engine)
     
     # only modify the matrix if an actual move was made instead of the function being called
-    if not np.array_equal(matrix, grid):
+    if moved:
         grid = populate(matrix)
         return grid, score, 1 # moved
 
@@ -151,31 +219,25 @@ def slide_to(goal_row, goal_col, size=4):
         return 1, 3
 
 # indicate valid moves
-def find_valid_moves(grid, size=4):
+def find_valid_moves(grid, size=4, engine="numpy", after=None):
+    after = after or afterstates(grid, size=size, engine=engine) # (grid, score, moved) for every move
     valid_moves = [-1, -1, -1, -1] # (left, right, up, down)
-    # can move left (2nd index refers to moves)
-    if move(grid, "left", size=size)[2]:
-        valid_moves[0] = 0
-    # can move right
-    if move(grid, "right", size=size)[2]:
-        valid_moves[1] = 1
-    # can move up
-    if move(grid, "up", size=size)[2]:
-        valid_moves[2] = 2
-    # can move down
-    if move(grid, "down", size=size)[2]:
-        valid_moves[3] = 3
+    # an action is valid if its move changes the grid (3rd index refers to moves)
+    for action in range(4):
+        if after[action][2]:
+            valid_moves[action] = action
     return valid_moves
 
 # determines the actions that give the maximum score
-def score_maximizer(x, y, grid, size):
+def score_maximizer(x, y, grid, size, engine="numpy", after=None):
+    after = after or afterstates(grid, size=size, engine=engine) # (grid, score, moved) for every move
     # define allowable actions
     actions = [x, y, 2 if y == 3 else 3]
 
     # get scores for allowable actions
     moves = []
     for action in actions:
-        score = move(grid, MAPPINGS[action], size=size)[1]
+        score = after[action][1]
         # scoring more
         if score > 0:
             moves.append((score, action))
@@ -192,24 +254,50 @@ def score_maximizer(x, y, grid, size):
 
 class Env2048(gym.Env):
 
-    def __init__(self, size=4):
+    def __init__(self, size=4, engine="numpy", seed=None, spawn_stream=False, profile=False, recorder=None, observation_mode="features"):
         super(Env2048, self).__init__()
         self.size = size # for grid size
+
+        # move engine ("numpy" and "table" work for any size, "bitboard" uses the packed 4x4 row tables)
+        if engine == "bitboard" and size != 4:
+            raise ValueError("bitboard engine only supports 4x4 grids")
+        self.engine = engine
+
+        # random source for new tiles, a SpawnStream gives every game from the same seed the same tile sequence
+        self.spawn_stream = spawn_stream
+        self.seed(seed)
+
+        # profile=True times every phase of step and reset (see profiling.py), None costs one check per phase
+        # (imported here so the env doesn't pull in stable_baselines3 / torch unless it's profiled)
+        if profile:
+            from profiling import PhaseProfiler
+        self.profiler = PhaseProfiler() if profile else None
+        self.recorder = recorder # recorder.Recorder that gets every transition (None records nothing)
         self.action_space = spaces.Discrete(4) # amount of actions (left, right, up, & down)
-        self.observation_space = spaces.Box(low=-np.inf, high=np.inf, shape=(9,), dtype=np.float32) # what we will observe
+
+        # "features" (the 9 engineered features), "onehot" or "log2" (the board itself, see observations.py)
+        # every step writes into self.observation, step / reset return a copy of the features (a new array every step, as before)
+        # but the buffer itself for the board modes: that observation changes on the next step, copy it to keep it
+        self.observation_space = observation_space(observation_mode, size) # what we will observe
+        self.observation_mode = observation_mode
+        self.observation = np.zeros(self.observation_space.shape, dtype=np.float32)
 
     # how the agent will modify the enviornment
     def step(self, action):
-
-        # Agent making move will handle invalid moves by not changing the grid
-        if action == 0:
-            self.grid, score, moves = move(self.grid, "left", size=self.size)
-        elif action == 1:
-            self.grid, score, moves = move(self.grid, "right", size=self.size)
-        elif action == 2:
-            self.grid, score, moves = move(self.grid, "up", size=self.size)
-        elif action == 3:
-            self.grid, score, moves = move(self.grid, "down", size=self.size)
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.start()
+
+        # Agent making move will handle invalid moves by not changing the grid (afterstates were computed with the last observation)
+        previous = self.board
+        after, score, moves = self.after[int(action)]
+        spawn = None
+        # only the move actually made gets a new tile
+        if moves:
+            spawn = after.populate(self.np_random)
+            self.board = after
+        if profiler is not None:
+            profiler.mark("step.move")
 
         # update game info
         self.states += 1
@@ -257,29 +345,58 @@ class Env2048(gym.Env):
                     self.reward -= 100
         
         self.reward *= self.discount # normalizing reward
+        if profiler is not None:
+            profiler.mark("step.reward")
 
         # checking if the game is over
-        if game_over(self.grid, size=self.size):
+        if self.board.game_over(stop_at_win=True):
             self.reward = 0 # don't account for points
             self.done = True
+        if profiler is not None:
+            profiler.mark("step.game_over")
+
+        if self.recorder is not None:
+            self.record(previous, action, spawn)
 
         # basic info for debugging
         info = dict(states=self.states, score=self.score, points=self.score-self.prevScore, 
                     moved="yes" if (self.moves - self.prevMoves) else "no", best_move=MAPPINGS.get(self.scoring_moves[0], "NA"), 
                     next_best=MAPPINGS.get(self.scoring_moves[1], "NA"), total=self.grid_sum, target=self.text, 
                     discount=self.discount)
+        if profiler is not None:
+            profiler.mark("step.info")
 
         # update previous info, get observation (updates for next state)
         self.prevScore = self.score
         self.prevMoves = self.moves
-        self.valid_moves = find_valid_moves(self.grid, self.size) # set valid moves for next run
-        self.scoring_moves = score_maximizer(self.slide_x, self.slide_y, self.grid, size=self.size) # find scoring moves for next run (dynamic change)
-        self.observation = np.array([self.slide_x, self.slide_y] + self.scoring_moves + self.valid_moves).astype(np.float32) # get obs
-        
-        return self.observation, self.reward, self.done, info
+        self.after = self.board.afterstates(engine=self.engine) # every move from the new state (computed once)
+        if profiler is not None:
+            profiler.mark("step.afterstates")
+        self.valid_moves = find_valid_moves(self.grid, self.size, after=self.after) # set valid moves for next run
+        if profiler is not None:
+            profiler.mark("step.valid_moves")
+        self.scoring_moves = score_maximizer(self.slide_x, self.slide_y, self.grid, size=self.size, after=self.after) # find scoring moves for next run (dynamic change)
+        if profiler is not None:
+            profiler.mark("step.score_maximizer")
+        self.observe() # get obs
+        if profiler is not None:
+            profiler.mark("step.observation")
+
+        return self.returned_observation(), self.reward, self.done, info
+
+    # sets the random source for new tiles
+    def seed(self, seed=None):
+        self.np_random = SpawnStream(seed) if self.spawn_stream else np.random.default_rng(seed)
+        return [seed]
+
+    # basically inits the enviornment (creates the 2048 grid), a seed makes the game reproducible
+    def reset(self, seed=None):
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.start()
+        if seed is not None:
+            self.seed(seed)
 
-    # basically inits the enviornment (creates the 2048 grid)
-    def reset(self):
         # basic data
         self.done = False
         self.score = 0
@@ -290,29 +407,81 @@ class Env2048(gym.Env):
         self.scale = 100
 
         # instantiate grid
-        self.grid = np.zeros((self.size, self.size)).astype(int)
-        self.grid = populate(self.grid, n_tiles=2)
+        self.board = Board(self.size)
+        self.board.populate(self.np_random, n_tiles=2)
+        self.game_id = int(self.recorder.new_games()[0]) if self.recorder is not None else None
+        if profiler is not None:
+            profiler.mark("reset.populate")
 
         # grid info
-        self.valid_moves = find_valid_moves(self.grid, self.size)
+        self.after = self.board.afterstates(engine=self.engine) # every move from the first state (computed once)
+        if profiler is not None:
+            profiler.mark("reset.afterstates")
+        self.valid_moves = find_valid_moves(self.grid, self.size, after=self.after)
+        if profiler is not None:
+            profiler.mark("reset.valid_moves")
         self.grid_sum = np.sum(self.grid)
-        self.goal_row, self.goal_col, self.text = find_goal_space(self.grid, size=self.size)
+        self.goal_row, self.goal_col, self.text = find_goal_space(self.board.exps, size=self.size)
         self.slide_x, self.slide_y = slide_to(self.goal_row, self.goal_col, size=self.size)
         self.worst_move = 1 if self.slide_x == 0 else 0
-        self.scoring_moves = score_maximizer(self.slide_x, self.slide_y, self.grid, size=self.size)
+        if profiler is not None:
+            profiler.mark("reset.goal")
+        self.scoring_moves = score_maximizer(self.slide_x, self.slide_y, self.grid, size=self.size, after=self.after)
+        if profiler is not None:
+            profiler.mark("reset.score_maximizer")
 
         # observation
-        self.observation = np.array([self.slide_x, self.slide_y] + self.scoring_moves + self.valid_moves).astype(np.float32) # what the Agent learns
-        return self.observation  # reward, done, info can't be included
+        self.observe() # what the Agent learns
+        if profiler is not None:
+            profiler.mark("reset.observation")
+        return self.returned_observation()  # reward, done, info can't be included
+
+    # writes the observation of the current state into the observation buffer
+    def observe(self):
+        if self.observation_mode == "features":
+            observation = self.observation
+            observation[0] = self.slide_x
+            observation[1] = self.slide_y
+            observation[2:5] = self.scoring_moves
+            observation[5:] = self.valid_moves
+        else:
+            encode(self.board.exps[None], self.observation_mode, out=self.observation[None])
+
+    # what step / reset hand out, the buffer itself only for board observations of a game that goes on
+    # (the last observation of a game is a copy, vec envs keep it as the terminal observation while they reset)
+    def returned_observation(self):
+        if self.observation_mode == "features" or self.done:
+            return self.observation.copy()
+        return self.observation
+
+    # tile values of the board (built from the exponents when asked for)
+    @property
+    def grid(self):
+        return self.board.values
+
+    # writes the transition that was just made (the board it was made on, the new tile if the board changed)
+    def record(self, previous, action, spawn):
+        spawn_cell, spawn_exp = spawn or (NO_SPAWN, 0)
+        self.recorder.append(previous.exps, int(action), spawn is not None, spawn_cell, spawn_exp, self.reward,
+                             self.score, self.game_id, self.states - 1, self.done)
+
+    # moves that change the grid (True) for maskable policies (sb3_contrib's MaskablePPO), so no step goes to an invalid move
+    def action_masks(self):
+        return np.array(self.valid_moves) >= 0
+
+    # {phase: (nanoseconds, calls)} of every profiled step / reset so far (empty without profile=True)
+    def profile_stats(self):
+        return {} if self.profiler is None else self.profiler.stats()
 
     # basic print to see how agent does
     def render(self, mode="console"):
         if mode != "console":
             raise NotImplementedError("Mode not supported")
         
-        print(self.grid.astype(int))
+        print(self.board)
         
 if __name__ == "__main__":
+    from stable_baselines3.common.env_checker import check_env
     env = Env2048() # create evniornment
 
     check_env(env) # make sure it passes check
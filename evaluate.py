@@ -0,0 +1,145 @@
+import argparse
+import inspect
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import stable_baselines3 as sb3
+from observations import model_mode
+from vec_env import VecEnv2048
+from expectimax import ExpectimaxAgent
+from montecarlo import MonteCarloAgent
+from ntuple import NTupleAgent
+from policy import load_policy
+from server import PolicyClient
+
+MAX_STEPS = 20000 # games still going after this many steps are cut off (a policy can keep picking an invalid move)
+PERCENTILES = [5, 25, 50, 75, 95]
+
+# loads an agent from a checkpoint path
+# "expectimax[:<ms per move>]" and "montecarlo[:<playouts per move>]" load the agents that need no training
+# n-tuple networks load from their .npy weights (memory-mapped, so worker processes share them)
+# "maskable:<path>" loads a MaskablePPO checkpoint (train.masked_model)
+# .npz loads an exported policy or a policy table (policy.py, no torch), "server:<address>" connects to a policy server
+def load_model(path):
+    if path.startswith("server:"):
+        return PolicyClient(path[7:])
+    if path.endswith(".npz"):
+        return load_policy(path)
+    if path.startswith("maskable:"):
+        from sb3_contrib import MaskablePPO
+        return MaskablePPO.load(path.partition(":")[2])
+    if path.endswith(".npy"):
+        return NTupleAgent.load(path[:-4])
+    if path.startswith("expectimax"):
+        budget = path.partition(":")[2]
+        return ExpectimaxAgent(time_budget=float(budget)) if budget else ExpectimaxAgent()
+    if path.startswith("montecarlo"):
+        playouts = path.partition(":")[2]
+        return MonteCarloAgent(playouts=int(playouts)) if playouts else MonteCarloAgent()
+    return sb3.PPO.load(path)
+
+# extra predict arguments for models that take action masks (MaskablePPO), nothing for the rest
+def mask_kwargs(model, masks):
+    return dict(action_masks=masks) if "action_masks" in inspect.signature(model.predict).parameters else {}
+
+# plays games all at once, one batched predict per step for every live game, returns per game stats
+# the games show the model the observation mode it was trained with (observations.model_mode)
+def play_games(model, games=1000, size=4, seed=None, deterministic=False, max_steps=MAX_STEPS):
+    env = VecEnv2048(games, size=size, seed=seed, auto_reset=False, observation_mode=model_mode(model, size))
+    obs = env.reset()
+    live = np.ones(games, dtype=bool)
+    lengths = np.zeros(games, dtype=np.int64)
+    invalid = np.zeros(games, dtype=np.int64)
+    actions = np.zeros(games, dtype=np.int64)
+    scores = np.zeros(games, dtype=np.int64)
+    max_tiles = np.zeros(games, dtype=np.int64)
+
+    while np.any(live) and env.states.max() < max_steps:
+        # only live games are sent through the model, finished boards keep stepping but are no longer counted
+        inputs = env.grids[live] if getattr(model, "uses_board", False) else obs[live] # search agents play from the grid
+        masks = mask_kwargs(model, env.action_masks()[live])
+        actions[live] = np.asarray(model.predict(inputs, deterministic=deterministic, **masks)[0]).reshape(-1)
+        reward, done, info = env.advance(actions)
+        obs = env.observation
+
+        lengths += live
+        invalid += live & ~info["moved"]
+
+        # final results of the games that just ended
+        ended = live & done
+        scores[ended] = info["score"][ended]
+        max_tiles[ended] = env.grids[ended].max(axis=(1, 2))
+        live &= ~done
+
+    # games cut off by max_steps
+    scores[live] = env.score[live]
+    max_tiles[live] = env.grids[live].max(axis=(1, 2))
+
+    return dict(score=scores, length=lengths, invalid=invalid, max_tile=max_tiles, finished=~live)
+
+# worker entry point (each process loads its own copy of the model)
+def play_chunk(path, games, size, seed, deterministic, max_steps):
+    return play_games(load_model(path), games=games, size=size, seed=seed, deterministic=deterministic, max_steps=max_steps)
+
+# evaluates a model (or a checkpoint path) over many games, n_workers > 1 spreads the games over a process pool
+def evaluate(model, games=1000, size=4, n_workers=1, seed=0, deterministic=False, max_steps=MAX_STEPS):
+    start = time.perf_counter()
+
+    # one chunk per worker, each with its own seed
+    if n_workers > 1:
+        if not isinstance(model, str):
+            raise ValueError("pass a checkpoint path to evaluate over several processes")
+        sizes = np.diff(np.linspace(0, games, n_workers + 1).astype(int))
+        seeds = [int(child.generate_state(1)[0]) for child in np.random.SeedSequence(seed).spawn(n_workers)]
+        with ProcessPoolExecutor(n_workers) as pool:
+            chunks = list(pool.map(play_chunk, [model] * n_workers, sizes, [size] * n_workers, seeds,
+                                   [deterministic] * n_workers, [max_steps] * n_workers))
+        stats = {key: np.concatenate([chunk[key] for chunk in chunks]) for key in chunks[0]}
+    else:
+        model = load_model(model) if isinstance(model, str) else model
+        stats = play_games(model, games=games, size=size, seed=seed, deterministic=deterministic, max_steps=max_steps)
+
+    return summarize(stats, time.perf_counter() - start)
+
+# turns per game stats into the evaluation report
+def summarize(stats, seconds):
+    games = len(stats["score"])
+    tiles, counts = np.unique(stats["max_tile"], return_counts=True)
+    return dict(games=games, seconds=seconds, games_per_second=games / seconds,
+                max_tile={int(tile): int(count) for tile, count in zip(tiles, counts)},
+                reached={int(tile): float(np.mean(stats["max_tile"] >= tile)) for tile in tiles},
+                score_mean=float(np.mean(stats["score"])),
+                score_percentiles={p: float(value) for p, value in zip(PERCENTILES, np.percentile(stats["score"], PERCENTILES))},
+                length_mean=float(np.mean(stats["length"])),
+                length_percentiles={p: float(value) for p, value in zip(PERCENTILES, np.percentile(stats["length"], PERCENTILES))},
+                invalid_rate=float(stats["invalid"].sum() / max(stats["length"].sum(), 1)),
+                unfinished=int(games - stats["finished"].sum()))
+
+# readable version of the report
+def format_report(report):
+    lines = [f"games: {report['games']} in {report['seconds']:.2f}s ({report['games_per_second']:.1f} games/s)",
+             f"score: mean {report['score_mean']:.1f} | " + " ".join(f"p{p}={v:.0f}" for p, v in report["score_percentiles"].items()),
+             f"length: mean {report['length_mean']:.1f} | " + " ".join(f"p{p}={v:.0f}" for p, v in report["length_percentiles"].items()),
+             f"invalid moves: {report['invalid_rate']:.2%}, unfinished games: {report['unfinished']}",
+             "max tile:  reached  games"]
+    for tile, count in report["max_tile"].items():
+        lines.append(f"{tile:>8}  {report['reached'][tile]:>7.2%}  {count:>5}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="evaluate a 2048 agent over many games")
+    parser.add_argument("model", help="checkpoint path, e.g. Agents/Agent-2940, Agents/Agent-2940.npz, Agents/Agent-2940.table.npz, server:127.0.0.1:5048, maskable:models/Masked-1 or models/ntuple.npy, expectimax[:ms] or montecarlo[:playouts]")
+    parser.add_argument("--games", type=int, default=10000)
+    parser.add_argument("--size", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--deterministic", action="store_true")
+    parser.add_argument("--json", action="store_true", help="print the report as json")
+    args = parser.parse_args()
+
+    report = evaluate(args.model, games=args.games, size=args.size, n_workers=args.workers, seed=args.seed,
+                      deterministic=args.deterministic)
+    print(json.dumps(report, indent=2) if args.json else format_report(report))
@@ -0,0 +1,227 @@
+import time
+import numpy as np
+import batch
+import bitboard
+import rows
+
+# heuristic weights for a single row (empty cells, merges, monotonicity and tile sums), scored on rows and columns
+LOST_PENALTY = 200000.0
+MONOTONICITY_POWER = 4.0
+MONOTONICITY_WEIGHT = 47.0
+SUM_POWER = 3.5
+SUM_WEIGHT = 11.0
+MERGES_WEIGHT = 700.0
+EMPTY_WEIGHT = 270.0
+
+TILE_PROBS = ((1, 0.5), (2, 0.5)) # new tiles (exponent, probability), populate picks 2 or 4 evenly
+
+_ROW_HEURISTIC = None
+
+# heuristic value of a row of exponents
+def row_heuristic(exps):
+    total = sum(exp ** SUM_POWER for exp in exps)
+    empty = sum(1 for exp in exps if exp == 0)
+
+    # adjacent equal tiles (ignoring empty cells between them)
+    merges = 0
+    prev = 0
+    counter = 0
+    for exp in exps:
+        if exp == 0:
+            continue
+        if prev == exp:
+            counter += 1
+        elif counter > 0:
+            merges += 1 + counter
+            counter = 0
+        prev = exp
+    if counter > 0:
+        merges += 1 + counter
+
+    # penalty for rows that aren't sorted in either direction
+    left = right = 0.0
+    for i in range(1, len(exps)):
+        if exps[i - 1] > exps[i]:
+            left += exps[i - 1] ** MONOTONICITY_POWER - exps[i] ** MONOTONICITY_POWER
+        else:
+            right += exps[i] ** MONOTONICITY_POWER - exps[i - 1] ** MONOTONICITY_POWER
+
+    return LOST_PENALTY + EMPTY_WEIGHT * empty + MERGES_WEIGHT * merges - MONOTONICITY_WEIGHT * min(left, right) - SUM_WEIGHT * total
+
+# 65,536 entry heuristic table for packed 4x4 rows
+def build_heuristic_table():
+    global _ROW_HEURISTIC
+
+    if _ROW_HEURISTIC is None:
+        _ROW_HEURISTIC = [row_heuristic([(row >> (4 * col)) & 0xF for col in range(4)]) for row in range(65536)]
+    return _ROW_HEURISTIC
+
+
+# 4x4 rules on packed 64-bit boards (bitboard.py)
+class BitboardRules:
+
+    def __init__(self):
+        self.heuristic_table = build_heuristic_table()
+        bitboard.build_tables()
+
+    def encode(self, grid):
+        return bitboard.encode(grid)
+
+    # moves that change the board (action, afterstate)
+    def moves(self, board):
+        after = []
+        for action in range(4):
+            result = bitboard.move_board(board, action)[0]
+            if result != board:
+                after.append((action, result))
+        return after
+
+    def empty_cells(self, board):
+        return [cell for cell in range(16) if not (board >> (4 * cell)) & 0xF]
+
+    def place(self, board, cell, exp):
+        return board | (exp << (4 * cell))
+
+    def heuristic(self, board):
+        table = self.heuristic_table
+        board_t = bitboard.transpose(board)
+        return (table[board & 0xFFFF] + table[(board >> 16) & 0xFFFF] + table[(board >> 32) & 0xFFFF] + table[board >> 48] +
+                table[board_t & 0xFFFF] + table[(board_t >> 16) & 0xFFFF] + table[(board_t >> 32) & 0xFFFF] + table[board_t >> 48])
+
+
+# rules for any size on boards stored as bytes of exponents (row major), rows go through the shared row cache
+class ByteRules:
+
+    def __init__(self, size, cache=rows.ROW_CACHE):
+        self.size = size
+        self.cache = cache
+        self.heuristics = {} # row bytes -> heuristic value
+
+    def encode(self, grid):
+        return batch.to_exponents(grid).tobytes()
+
+    def merge(self, line, reverse):
+        merged = self.cache.lookup(line[::-1] if reverse else line)[0]
+        return merged[::-1] if reverse else merged
+
+    def moves(self, board):
+        size = self.size
+        after = []
+        for action in range(4):
+            result = bytearray(board)
+            # left / right work on rows, up / down on columns (a column is every size-th byte)
+            for i in range(size):
+                if action < 2:
+                    result[i * size:(i + 1) * size] = self.merge(board[i * size:(i + 1) * size], action == 0)
+                else:
+                    result[i::size] = self.merge(board[i::size], action == 2)
+            result = bytes(result)
+            if result != board:
+                after.append((action, result))
+        return after
+
+    def empty_cells(self, board):
+        return [cell for cell, exp in enumerate(board) if not exp]
+
+    def place(self, board, cell, exp):
+        return board[:cell] + bytes((exp,)) + board[cell + 1:]
+
+    def line_heuristic(self, line):
+        value = self.heuristics.get(line)
+        if value is None:
+            value = self.heuristics[line] = row_heuristic(list(line))
+        return value
+
+    def heuristic(self, board):
+        size = self.size
+        return sum(self.line_heuristic(board[i * size:(i + 1) * size]) + self.line_heuristic(board[i::size]) for i in range(size))
+
+
+class SearchTimeout(Exception):
+    pass
+
+# depth limited expectimax over move and tile spawn nodes with a transposition table, chance pruning and
+# iterative deepening under a per move time budget (milliseconds)
+# plays from the grid itself, so callers pass env.grid / Grid.grid instead of the 9 feature observation (uses_board)
+class ExpectimaxAgent:
+
+    uses_board = True
+
+    def __init__(self, time_budget=50, max_depth=8, prob_cutoff=1e-4):
+        self.time_budget = time_budget
+        self.max_depth = max_depth
+        self.prob_cutoff = prob_cutoff
+        self.rules = {} # grid size -> rules
+        self.table = {} # board -> (remaining depth, value) for the current search
+        self.deadline = None
+        self.nodes = 0
+
+    # packed boards for 4x4 grids (unless a tile could overflow a nibble), bytes for everything else
+    def rules_for(self, grid):
+        key = "bitboard" if len(grid) == 4 and bitboard.fits(grid) else len(grid)
+        if key not in self.rules:
+            self.rules[key] = BitboardRules() if key == "bitboard" else ByteRules(key)
+        return self.rules[key]
+
+    # expected value over every empty cell and new tile
+    def chance_node(self, rules, board, prob, depth):
+        if depth == 0 or prob < self.prob_cutoff:
+            return rules.heuristic(board)
+
+        # reuse boards already searched at least as deep
+        entry = self.table.get(board)
+        if entry is not None and entry[0] >= depth:
+            return entry[1]
+
+        self.nodes += 1
+        if time.perf_counter() > self.deadline:
+            raise SearchTimeout
+
+        cells = rules.empty_cells(board)
+        value = 0.0
+        for cell in cells:
+            for exp, tile_prob in TILE_PROBS:
+                value += tile_prob * self.move_node(rules, rules.place(board, cell, exp), prob * tile_prob / len(cells), depth)
+        value /= len(cells)
+
+        self.table[board] = (depth, value)
+        return value
+
+    # best value over the moves that change the board (0 if the game is lost)
+    def move_node(self, rules, board, prob, depth):
+        best = 0.0
+        for action, after in rules.moves(board):
+            best = max(best, self.chance_node(rules, after, prob, depth - 1))
+        return best
+
+    # best action for a grid of tile values (-1 if no move changes the grid)
+    def act(self, grid):
+        grid = np.asarray(grid)
+        rules = self.rules_for(grid)
+        board = rules.encode(grid)
+        moves = rules.moves(board)
+        if not moves:
+            return -1
+
+        self.deadline = time.perf_counter() + self.time_budget / 1000
+        best_action = moves[0][0]
+
+        # iterative deepening, keep the result of the deepest search that finished in time
+        for depth in range(1, self.max_depth + 1):
+            self.table = {}
+            try:
+                values = [(self.chance_node(rules, after, 1.0, depth - 1), action) for action, after in moves]
+            except SearchTimeout:
+                break
+            best_action = max(values)[1]
+            if time.perf_counter() > self.deadline:
+                break
+
+        return best_action
+
+    # same interface as model.predict (a single grid or a batch of grids)
+    def predict(self, observation, state=None, episode_start=None, deterministic=True):
+        observation = np.asarray(observation)
+        if observation.ndim == 2:
+            return np.array(max(self.act(observation), 0)), state
+        return np.array([max(self.act(grid), 0) for grid in observation]), state
@@ -3,15 +3,125 @@ import customtkinter as ctk
 from PIL import ImageTk, Image
 import numpy as np
 from grid import Grid
-from env import Env2048, game_over
-import stable_baselines3 as sb3
+from env import Env2048
+from expectimax import ExpectimaxAgent
+from montecarlo import MonteCarloAgent
+from ntuple import NTupleAgent
+from policy import NumpyPolicy
+from server import PolicyClient
 import style
+import threading
+import inspect
+import queue
 import sys
 import os
 
 path = os.path.abspath(os.path.dirname(__file__))
 timestep = 2940
-model = sb3.PPO.load(f"Agents/Agent-{timestep}")
+agent = "ppo" # "ppo", "maskable" or "ntuple" for the trained agents, "server" for the agent server.py serves, "expectimax" or "montecarlo" for the agents that need no training
+
+# the agent loads on a background thread once the menu is showing (torch / stable_baselines3 only get imported there)
+model = None
+model_error = None
+model_ready = threading.Event() # set once loading finished (or failed)
+loader = None
+
+def load_model():
+    global model, model_error
+    try:
+        if agent == "ntuple":
+            model = NTupleAgent.load("models/ntuple") # trained with ntuple.py
+        elif agent == "expectimax":
+            model = ExpectimaxAgent(time_budget=100)
+        elif agent == "montecarlo":
+            model = MonteCarloAgent(playouts=100, time_budget=200)
+        elif agent == "server":
+            model = PolicyClient() # default address of server.py
+        elif agent == "maskable":
+            from sb3_contrib import MaskablePPO
+            model = MaskablePPO.load(f"models/Masked-{timestep}") # trained with train.masked_model
+        elif os.path.exists(f"{path}/Agents/Agent-{timestep}.npz"):
+            model = NumpyPolicy.load(f"{path}/Agents/Agent-{timestep}.npz") # exported with policy.py (no torch needed)
+        else:
+            import stable_baselines3 as sb3
+            model = sb3.PPO.load(f"Agents/Agent-{timestep}")
+    except Exception as error:
+        model_error = error
+        print(f"couldn't load the agent: {error}")
+    finally:
+        model_ready.set()
+
+# starts loading the agent (only the first call does anything)
+def prefetch_model():
+    global loader
+    if loader is None:
+        loader = threading.Thread(target=load_model, daemon=True)
+        loader.start()
+
+SPEEDS = [1000, 500, 250, 100, 25, 0] # milliseconds per agent move ("-" / "+" in agent mode), 0 is as fast as possible
+QUEUE_SIZE = 64 # boards the agent can play ahead of the screen
+
+# model's action limited to the moves that change the board (valid_moves from the env, -1 marks an invalid move)
+# a policy that picks an invalid move gets its next action sampled from its own distribution over the valid ones
+def masked_action(model, env, rng):
+    legal = env.action_masks()
+    masks = dict(action_masks=legal) if "action_masks" in inspect.signature(model.predict).parameters else {} # MaskablePPO
+    action, state = model.predict(env.grid if getattr(model, "uses_board", False) else env.observation, **masks)
+    action = int(action)
+    if legal[action] or not np.any(legal):
+        return action
+
+    probs = None
+    if hasattr(model, "probabilities"): # numpy policy
+        probs = model.probabilities(env.observation)
+    elif hasattr(model, "policy"):
+        obs = model.policy.obs_to_tensor(env.observation)[0]
+        probs = model.policy.get_distribution(obs).distribution.probs[0].detach().cpu().numpy()
+    if probs is not None:
+        probs = np.where(legal, probs, 0)
+        if probs.sum() > 0:
+            return int(rng.choice(4, p=probs / probs.sum()))
+    return int(np.flatnonzero(legal)[0])
+
+# plays the agent's game on its own thread, every finished board goes into a bounded queue the UI draws from
+# (a full queue makes the worker wait, so it never runs far ahead of the screen)
+class AgentWorker(threading.Thread):
+
+    def __init__(self, env):
+        threading.Thread.__init__(self, daemon=True)
+        self.env = env
+        self.states = queue.Queue(maxsize=QUEUE_SIZE) # (board, score, moves, done)
+        self.running = threading.Event() # cleared while the game is paused
+        self.stopped = threading.Event()
+        self.rng = np.random.default_rng()
+        self.running.set()
+
+    def run(self):
+        done = False
+        while not done:
+            self.running.wait()
+            if self.stopped.is_set():
+                return
+            obs, reward, done, info = self.env.step(masked_action(model, self.env, self.rng))
+            state = (self.env.board, self.env.score, self.env.moves, done) # a board is never changed once it's been moved to
+
+            # wait for room in the queue (checking every so often if the game was closed)
+            while not self.stopped.is_set():
+                try:
+                    self.states.put(state, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+
+    def pause(self):
+        self.running.clear()
+
+    def resume(self):
+        self.running.set()
+
+    def stop(self):
+        self.stopped.set()
+        self.running.set()
 
 class Game(tk.Frame):
 
@@ -24,9 +134,10 @@ class Game(tk.Frame):
         self.main_grid.grid(pady=(80, 0))
         self.title = "2048" if self.user else "2048 AI"
         self.master.title(self.title)
+        self.engine = "bitboard" if self.size == 4 else "table" # fastest move engine for the grid size
 
         # For agent
-        self.env = Env2048(self.size)
+        self.env = Env2048(self.size, engine=self.engine)
         self.obs = self.env.reset()
         print(self.obs)
         self.continue_update = True
@@ -49,9 +160,18 @@ class Game(tk.Frame):
             self.master.bind("d", self.right)
             self.master.bind("w", self.up)
             self.master.bind("s", self.down) 
-        # Agent
+        # Agent (starts once the model is loaded)
         else:
-            self.master.after(3000, self.update)
+            self.loading = None
+            self.worker = None
+            self.speed = SPEEDS.index(500)
+            self.master.title(f"{self.title} ({SPEEDS[self.speed]} ms/move)")
+            self.play_job = None # pending play callback
+            self.master.bind("<minus>", self.slower)
+            self.master.bind("<plus>", self.faster)
+            self.master.bind("<equal>", self.faster)
+            prefetch_model()
+            self.master.after(0, self.wait_for_model, 3000)
 
         self.mainloop() # get the infinite loop going
         
@@ -72,6 +192,7 @@ class Game(tk.Frame):
                 cell_data = {"frame": cell_frame, "number": cell_num}
                 row.append(cell_data) # add created tile to row     
             self.cells.append(row) # add populated row to matrix
+        self.drawn = np.zeros((self.size, self.size), dtype=np.uint8) # exponents the tiles currently show (starts empty)
         
         # Header labels
 
@@ -91,49 +212,90 @@ class Game(tk.Frame):
 
     # inits grid with tiles
     def start_game(self):
-        self.matrix = Grid(self.size) if self.user else self.env
-        row, col = np.where(self.matrix.grid == 2)
-
-        for row, col in zip(row, col):
-            self.cells[row][col]["frame"].configure(bg=style.CELL_COLORS[2])
-            self.cells[row][col]["number"].configure(bg=style.CELL_COLORS[2], fg=style.CELL_NUMBER_COLORS[2], font=style.CELL_NUMBER_FONTS[2], text="2")
-
-    # updates the GUI when events occur
+        self.matrix = Grid(self.size, engine=self.engine) if self.user else self.env
+        self.draw()
+
+    # redraws only the tiles that changed since the last draw (the current board unless one is given)
+    def draw(self, board=None):
+        exps = (self.matrix.board if board is None else board).exps
+
+        for i, j in zip(*np.nonzero(exps != self.drawn)):
+            exp = int(exps[i, j])
+            cell_val = 1 << exp if exp else 0 # tile at a location (0 is an empty cell)
+            bg, fg, font, text = style.CELL_STYLES.get(cell_val) or style.cell_style(cell_val)
+            self.cells[i][j]["frame"].configure(bg=bg)
+            self.cells[i][j]["number"].configure(bg=bg, fg=fg, font=font, text=text)
+
+        self.drawn = exps
+
+    # shows a loading indicator until the agent is ready, then starts playing after delay milliseconds
+    def wait_for_model(self, delay):
+        if not model_ready.is_set() or model is None:
+            if self.loading is None:
+                self.loading = tk.Frame(self.main_grid, borderwidth=2)
+                self.loading.place(relx=0.5, rely=0.5, anchor="center")
+                self.loading_label = tk.Label(self.loading, text="Loading agent...", bg=style.EMPTY_CELL_COLOR, fg=style.GAME_OVER_FONT_COLOR, font=style.SCORE_FONT)
+                self.loading_label.pack()
+
+            # loading failed, the message stays up
+            if model_ready.is_set():
+                self.loading_label.configure(text="Agent failed to load")
+            else:
+                self.master.after(100, self.wait_for_model, max(delay - 100, 0))
+            return
+
+        if self.loading is not None:
+            self.loading.destroy()
+            self.loading = None
+        self.worker = AgentWorker(self.env)
+        self.master.after(delay, self.start_worker)
+
+    def start_worker(self):
+        if not self.worker.is_alive() and not self.worker.stopped.is_set():
+            self.worker.start()
+        if self.continue_update:
+            self.play()
+
+    # draws the next board the agent played (at full speed every queued board is skipped but the newest)
+    def play(self):
+        state = None
+        try:
+            state = self.worker.states.get_nowait()
+            while not SPEEDS[self.speed]:
+                state = self.worker.states.get_nowait()
+        except queue.Empty:
+            pass
+
+        if state is not None:
+            board, score, moves, done = state
+            self.draw(board)
+            self.score_label.configure(text=str(int(score)))
+            self.move_label.configure(text=str(int(moves)))
+            self.game_over(board)
+
+        self.play_job = self.master.after(max(SPEEDS[self.speed], 1), self.play) if self.continue_update else None
+
+    # agent speed controls
+    def slower(self, event):
+        self.speed = max(self.speed - 1, 0)
+        self.show_speed()
+
+    def faster(self, event):
+        self.speed = min(self.speed + 1, len(SPEEDS) - 1)
+        self.show_speed()
+
+    def show_speed(self):
+        speed = SPEEDS[self.speed]
+        self.master.title(f"{self.title} ({speed} ms/move)" if speed else f"{self.title} (max speed)")
+
+    # updates the GUI after the user's moves (the agent's boards are drawn by play)
     def update(self):
-
-        # move agent until move is valid
-        if not self.user:
-            temp = self.matrix.grid
-            while np.array_equal(temp, self.matrix.grid):
-                # uses a trained Reinforcment Learning model to play the game
-                action, state = model.predict(self.obs)
-                self.obs, reward, done, info = self.matrix.step(action) # make move and get new observation (new state)
-
-        # iterate rows and columns
-        for i in range(self.size):
-            for j in range(self.size):
-                cell_val = int(self.matrix.grid[i][j]) # tile at a location
-
-                # tiles that are zero in the matrix
-                if not cell_val:
-                    self.cells[i][j]["frame"].configure(bg=style.EMPTY_CELL_COLOR)
-                    self.cells[i][j]["number"].configure(bg=style.EMPTY_CELL_COLOR, text="")
-
-                # non-zero tiles in the matrix
-                else:
-                    self.cells[i][j]["frame"].configure(bg=style.CELL_COLORS[cell_val])
-                    self.cells[i][j]["number"].configure(bg=style.CELL_COLORS[cell_val], fg=style.CELL_NUMBER_COLORS[cell_val], font=style.CELL_NUMBER_FONTS[cell_val], text=str(cell_val))
+        self.draw() # only the tiles that changed
         
         # Updating score and move labels
         self.score_label.configure(text=str(int(self.matrix.score)))
         self.move_label.configure(text=str(int(self.matrix.moves)))
-
-        if self.user:
-            self.update_idletasks()
-        else:
-            self.game_over()
-            if self.continue_update:
-                self.master.after(500, self.update)
+        self.update_idletasks()
 
     
     # sliding tiles right
@@ -175,6 +337,11 @@ class Game(tk.Frame):
             self.master.unbind("<Down>")
         else:
             self.continue_update = False
+            if self.play_job is not None:
+                self.master.after_cancel(self.play_job)
+                self.play_job = None
+            if self.worker is not None:
+                self.worker.pause()
 
     def enable(self):
 
@@ -193,7 +360,9 @@ class Game(tk.Frame):
         else:
             # Allow agent to take steps and update GUI
             self.continue_update = True
-            self.update()
+            if self.worker is not None:
+                self.worker.resume()
+                self.play()
 
     # disabled arrows and displays pause button
     def pause(self, event):
@@ -230,20 +399,24 @@ class Game(tk.Frame):
     # closes the game and reloads the main menu
     def quit(self):
         self.disable()
+        if not self.user and self.worker is not None:
+            self.worker.stop()
         self.master.destroy()
         Menu()
         
-    # indicates if the game is over or not
-    def game_over(self):
-        # players wins (hits 2048 tile)
-        if np.any(self.matrix.grid == 2048):
+    # indicates if the game is over or not (for the current board unless one is given)
+    def game_over(self, board=None):
+        board = self.matrix.board if board is None else board
+
+        # players wins (hits 2048 tile), tiles only grow so a 2048 merged away in a board play skipped still counts
+        if board.max_tile() >= 2048:
             game_over_frame = tk.Frame(self.main_grid, borderwidth=2)
             game_over_frame.place(relx=0.5, rely=0.5, anchor="center")
             tk.Label(game_over_frame, text="You Won", bg=style.WINNER_BG, fg=style.GAME_OVER_FONT_COLOR, font=style.GAME_OVER_FONT).pack()
             self.disable() # disable any keyboard inputs
             
         # player loses (no more moves can be made)
-        elif game_over(self.matrix.grid.astype(int)):
+        elif board.game_over():
             game_over_frame = tk.Frame(self.main_grid, borderwidth=2)
             game_over_frame.place(relx=0.5, rely=0.5, anchor="center")
             tk.Label(game_over_frame, text="You Lost!", bg=style.LOSER_BG, fg=style.GAME_OVER_FONT_COLOR, font=style.GAME_OVER_FONT).pack()
@@ -351,6 +524,9 @@ class Menu(tk.Tk):
         btn_play_ai_2048.place(anchor="center", relx=0.5, rely=0.85)
         ctk.set_appearance_mode("dark")
 
+        # start loading the agent in the background once the menu is on screen
+        self.after(100, prefetch_model)
+
         # loop window frames
         self.mainloop() 
 
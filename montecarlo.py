@@ -0,0 +1,75 @@
+import time
+import numpy as np
+import batch
+
+# picks each move by playing many random (or greedy) games from every legal afterstate and taking the best average score
+# all playouts of a decision advance together as one batch of boards (batch.py)
+# plays from the grid itself, so callers pass env.grid / Grid.grid instead of the 9 feature observation (uses_board)
+class MonteCarloAgent:
+
+    uses_board = True
+
+    def __init__(self, playouts=100, depth=None, policy="random", time_budget=None, seed=None):
+        self.playouts = playouts # playouts per legal move (per round when there's a time budget)
+        self.depth = depth # moves per playout (None plays until the game is lost)
+        self.policy = policy # "random" or "greedy" (highest scoring move, random among ties)
+        self.time_budget = time_budget # milliseconds per move, extra rounds of playouts run while there's time left
+        self.rng = np.random.default_rng(seed)
+
+    # plays every board until it's lost (or the depth / deadline), returns the score gained by each board
+    def rollout(self, boards, deadline):
+        total = np.zeros(len(boards), dtype=np.int64)
+        index = np.arange(len(boards))
+        alive = np.ones(len(boards), dtype=bool)
+        steps = 0
+
+        while np.any(alive) and (self.depth is None or steps < self.depth) and time.perf_counter() < deadline:
+            after, scores, moved = batch.afterstates(boards)
+
+            # random legal move, or the best scoring legal move with random tie breaks
+            noise = self.rng.random(moved.shape)
+            if self.policy == "greedy":
+                noise = noise + scores
+            actions = np.argmax(np.where(moved, noise, -1), axis=0)
+
+            alive &= moved.any(axis=0)
+            boards = after[actions, index]
+            total += np.where(alive, scores[actions, index], 0)
+            batch.populate(boards, self.rng, mask=alive)
+            steps += 1
+
+        return total
+
+    # best action for a grid of tile values (-1 if no move changes the grid)
+    def act(self, grid):
+        start = time.perf_counter()
+        deadline = np.inf if self.time_budget is None else start + self.time_budget / 1000
+
+        after, scores, moved = batch.afterstates(batch.to_exponents(np.asarray(grid))[None])
+        legal = np.flatnonzero(moved[:, 0])
+        if len(legal) == 0:
+            return -1
+        if len(legal) == 1:
+            return int(legal[0])
+
+        totals = np.zeros(len(legal))
+        count = 0
+        while True:
+            # every legal afterstate gets a new tile, then all playouts advance together
+            boards = np.repeat(after[legal, 0], self.playouts, axis=0)
+            batch.populate(boards, self.rng)
+            outcome = self.rollout(boards, deadline).reshape(len(legal), self.playouts)
+            totals += outcome.sum(axis=1)
+            count += self.playouts
+
+            if time.perf_counter() >= deadline or self.time_budget is None:
+                break
+
+        return int(legal[np.argmax(scores[legal, 0] + totals / count)])
+
+    # same interface as model.predict (a single grid or a batch of grids)
+    def predict(self, observation, state=None, episode_start=None, deterministic=True):
+        observation = np.asarray(observation)
+        if observation.ndim == 2:
+            return np.array(max(self.act(observation), 0)), state
+        return np.array([max(self.act(grid), 0) for grid in observation]), state
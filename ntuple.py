@@ -0,0 +1,177 @@
+import argparse
+import json
+import time
+from collections import deque
+import numpy as np
+import batch
+from env import Env2048
+
+# n-tuple value network over afterstates (TD learning, see Szubert & Jaskowski 2014)
+# every tuple looks at a few cells, the packed exponents of those cells index one float32 weight per tuple
+# each tuple is applied to the 8 symmetric images of the board, all weights live in one flat array
+
+PATTERNS_4X6 = [[(0, 0), (0, 1), (0, 2), (0, 3), (1, 0), (1, 1)],
+                [(1, 0), (1, 1), (1, 2), (1, 3), (2, 0), (2, 1)],
+                [(0, 0), (0, 1), (0, 2), (1, 0), (1, 1), (1, 2)],
+                [(1, 0), (1, 1), (1, 2), (2, 0), (2, 1), (2, 2)]] # 4 x 16^6 weights (~270MB)
+PATTERNS_SMALL = [[(0, 0), (0, 1), (0, 2), (0, 3)],
+                  [(1, 0), (1, 1), (1, 2), (1, 3)],
+                  [(0, 0), (0, 1), (1, 0), (1, 1)],
+                  [(1, 0), (1, 1), (2, 0), (2, 1)],
+                  [(1, 1), (1, 2), (2, 1), (2, 2)]] # 5 x 16^4 weights (~1.3MB)
+MAX_EXPONENT = 15 # exponents are packed in 4 bits per cell
+
+# the 8 symmetric images of a cell on a size x size board
+def symmetries(row, col, size):
+    last = size - 1
+    return [(row, col), (col, row), (row, last - col), (last - row, col), (last - row, last - col),
+            (col, last - row), (last - col, row), (last - col, last - row)]
+
+
+class NTupleAgent:
+
+    uses_board = True
+
+    def __init__(self, size=4, patterns=PATTERNS_4X6, weights=None):
+        self.size = size
+        self.patterns = [[tuple(cell) for cell in pattern] for pattern in patterns]
+        self.length = len(self.patterns[0])
+        if any(len(pattern) != self.length for pattern in self.patterns):
+            raise ValueError("every pattern needs the same number of cells")
+
+        # flat cell index of every (pattern, symmetry) image, shape (patterns * 8, length)
+        images = []
+        for pattern in self.patterns:
+            for k in range(8):
+                images.append([symmetries(row, col, size)[k] for row, col in pattern])
+        self.cells = np.array([[row * size + col for row, col in image] for image in images])
+        self.powers = 16 ** np.arange(self.length) # packed exponents -> index within a pattern's table
+        self.offsets = np.repeat(np.arange(len(self.patterns)) * 16 ** self.length, 8) # start of each pattern's table
+
+        self.weights = np.zeros(len(self.patterns) * 16 ** self.length, dtype=np.float32) if weights is None else weights
+
+    # weight indices of every tuple image for a batch of exponent boards, shape (B, patterns * 8)
+    def features(self, boards):
+        flat = np.minimum(boards.reshape(len(boards), -1), MAX_EXPONENT).astype(np.int64)
+        return flat[:, self.cells] @ self.powers + self.offsets
+
+    # value of a batch of exponent boards
+    def values(self, boards):
+        return self.weights[self.features(boards)].sum(axis=1)
+
+    # legal moves of an exponent board and their move score + afterstate value (empty if no move changes the board)
+    def evaluate_moves(self, board):
+        after, scores, moved = batch.afterstates(board[None])
+        legal = np.flatnonzero(moved[:, 0])
+        if len(legal) == 0:
+            return legal, None, None
+        afterstates = after[legal, 0]
+        return legal, afterstates, scores[legal, 0] + self.values(afterstates)
+
+    # best action for a grid of tile values (-1 if no move changes the grid)
+    def act(self, grid):
+        legal, afterstates, values = self.evaluate_moves(batch.to_exponents(np.asarray(grid)))
+        return int(legal[np.argmax(values)]) if len(legal) else -1
+
+    # same interface as model.predict (a single grid or a batch of grids)
+    def predict(self, observation, state=None, episode_start=None, deterministic=True):
+        observation = np.asarray(observation)
+        if observation.ndim == 2:
+            return np.array(max(self.act(observation), 0)), state
+        return np.array([max(self.act(grid), 0) for grid in observation]), state
+
+    # moves the weights of an afterstate (given by its feature indices) towards a target error
+    def update(self, features, delta, alpha):
+        np.add.at(self.weights, features, alpha * delta / len(features))
+
+    # writes the weights as a .npy (so other processes can memory-map them) plus a small .json with the layout
+    def save(self, path):
+        np.save(f"{path}.npy", self.weights)
+        with open(f"{path}.json", "w") as file:
+            json.dump(dict(size=self.size, patterns=self.patterns), file)
+
+    # loads saved weights, memory-mapped (read only and shared between processes) unless they'll be trained further
+    @classmethod
+    def load(cls, path, mmap=True):
+        with open(f"{path}.json") as file:
+            layout = json.load(file)
+        weights = np.load(f"{path}.npy", mmap_mode="r" if mmap else None)
+        return cls(size=layout["size"], patterns=layout["patterns"], weights=weights)
+
+
+# plays one Env2048 game greedily on afterstate values and learns from it with TD(lambda) (lam=0 is TD(0))
+# traces are cut after trace_length afterstates, returns the game score and max tile
+def train_episode(agent, env, alpha=0.1, lam=0.0, trace_length=5):
+    env.reset()
+    history = deque(maxlen=trace_length if lam > 0 else 1) # feature indices of the last afterstates, newest last
+    prev_value = None
+    done = False
+
+    while not done:
+        # the env already computed every afterstate of the current grid
+        legal = [action for action in range(4) if env.after[action][2]]
+        if len(legal) == 0:
+            break
+        afterstates = np.stack([env.after[action][0].exps for action in legal]) # already exponents
+        values = np.array([env.after[action][1] for action in legal]) + agent.values(afterstates)
+        best = np.argmax(values)
+        features = agent.features(afterstates[best:best + 1])[0]
+
+        # previous afterstate moves towards the reward of this move plus the value of the new afterstate
+        if prev_value is not None:
+            delta = values[best] - prev_value
+            for k, trace in enumerate(reversed(history)):
+                agent.update(trace, delta * lam ** k, alpha)
+
+        history.append(features)
+        prev_value = agent.weights[features].sum()
+        obs, reward, done, info = env.step(legal[best])
+
+    # the last afterstate leads nowhere (value 0)
+    if prev_value is not None:
+        for k, trace in enumerate(reversed(history)):
+            agent.update(trace, -prev_value * lam ** k, alpha)
+
+    return env.score, env.board.max_tile()
+
+# trains an agent over many games, prints progress every log_every games
+def train(agent, episodes=10000, alpha=0.1, lam=0.0, trace_length=5, seed=None, log_every=1000, save_path=None):
+    engine = "bitboard" if agent.size == 4 else "table"
+    env = Env2048(agent.size, engine=engine, seed=seed)
+    scores, tiles = [], []
+    start = time.perf_counter()
+
+    for episode in range(1, episodes + 1):
+        score, tile = train_episode(agent, env, alpha=alpha, lam=lam, trace_length=trace_length)
+        scores.append(score)
+        tiles.append(tile)
+
+        if log_every and episode % log_every == 0:
+            recent = np.array(tiles[-log_every:])
+            print(f"episode {episode}: mean score {np.mean(scores[-log_every:]):.0f}, 2048 rate {np.mean(recent >= 2048):.2%}, "
+                  f"1024 rate {np.mean(recent >= 1024):.2%}, {time.perf_counter() - start:.0f}s")
+            if save_path:
+                agent.save(save_path)
+
+    if save_path:
+        agent.save(save_path)
+    return agent
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="train an n-tuple network agent with TD learning")
+    parser.add_argument("--out", default="models/ntuple", help="saves <out>.npy and <out>.json")
+    parser.add_argument("--episodes", type=int, default=100000)
+    parser.add_argument("--size", type=int, default=4)
+    parser.add_argument("--alpha", type=float, default=0.1)
+    parser.add_argument("--lam", type=float, default=0.0)
+    parser.add_argument("--small", action="store_true", help="4-tuples instead of 6-tuples (much less memory)")
+    parser.add_argument("--resume", action="store_true", help="continue training the weights saved at --out")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.resume:
+        agent = NTupleAgent.load(args.out, mmap=False)
+    else:
+        agent = NTupleAgent(size=args.size, patterns=PATTERNS_SMALL if args.small else PATTERNS_4X6)
+    train(agent, episodes=args.episodes, alpha=args.alpha, lam=args.lam, seed=args.seed, save_path=args.out)
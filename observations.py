@@ -0,0 +1,63 @@
+import numpy as np
+from gym import spaces
+from policy import NumpyPolicy
+
+# what Env2048 / VecEnv2048 show the agent (observation_mode)
+# "features": the 9 engineered features (slide_x, slide_y, 3 scoring moves, 4 valid moves), what the shipped agents use
+# "onehot":   the board as one-hot exponent planes, (N, N, channels) flattened row major (cell k is entries k*C..k*C+C-1)
+# "log2":     the board's exponents scaled to [0, 1], (N, N) flattened row major
+# board observations are flat so MlpPolicy, policy.NumpyPolicy and server.py take them like the features
+# every mode writes into a buffer the env allocates once (encode(..., out=buffer))
+
+MODES = ("features", "onehot", "log2")
+FEATURES = 9
+
+# exponents a size x size board can hold, 0 (empty) up to size * size + 1 (the largest tile it can ever make)
+def channels(size):
+    return size * size + 2
+
+def observation_shape(mode, size):
+    if mode == "features":
+        return (FEATURES,)
+    if mode == "onehot":
+        return (size * size * channels(size),)
+    if mode == "log2":
+        return (size * size,)
+    raise ValueError(f"unknown observation mode {mode}, use one of {MODES}")
+
+def observation_space(mode, size):
+    if mode == "features":
+        return spaces.Box(low=-np.inf, high=np.inf, shape=(FEATURES,), dtype=np.float32)
+    return spaces.Box(low=0, high=1, shape=observation_shape(mode, size), dtype=np.float32)
+
+# the observation mode a model was trained with, from the width of its input (9 features unless it says otherwise)
+# agents that play from the grid (uses_board) get the features, they never look at the observation
+def model_mode(model, size):
+    if getattr(model, "uses_board", False):
+        return "features"
+    if hasattr(model, "observation_space"): # stable baselines model
+        width = int(np.prod(model.observation_space.shape))
+    elif isinstance(model, NumpyPolicy):
+        width = model.weights[0].shape[0]
+    else:
+        return "features"
+    for mode in MODES:
+        if observation_shape(mode, size) == (width,):
+            return mode
+    raise ValueError(f"model takes {width} inputs, no observation mode of a {size}x{size} board has that many")
+
+# board observations of a batch of exponent boards (B, N, N) written into out (B, width), allocated if out is None
+def encode(boards, mode, out=None):
+    n_boards, size = boards.shape[:2]
+    if out is None:
+        out = np.empty((n_boards,) + observation_shape(mode, size), dtype=np.float32)
+    cells = boards.reshape(n_boards, size * size)
+
+    if mode == "log2":
+        np.multiply(cells, np.float32(1 / (channels(size) - 1)), out=out)
+    elif mode == "onehot":
+        out.fill(0)
+        np.put_along_axis(out.reshape(n_boards, size * size, channels(size)), cells[:, :, None], 1, axis=2)
+    else:
+        raise ValueError(f"{mode} observations aren't computed from the board")
+    return out
@@ -0,0 +1,162 @@
+import argparse
+import io
+import zipfile
+import numpy as np
+
+# torch free version of a trained PPO agent: the policy network's weights in a .npz and its forward pass in numpy
+# python policy.py Agents/Agent-2940                    writes Agents/Agent-2940.npz (exporting needs torch once)
+# python policy.py Agents/Agent-2940 --table            writes Agents/Agent-2940.table.npz (every observation's action)
+
+ACTIVATIONS = {"tanh": np.tanh, "relu": lambda x: np.maximum(x, 0)} # stable baselines' MlpPolicy uses tanh by default
+
+# policy network weights (shared layers, policy layers, action layer) of a stable baselines3 checkpoint (path or file object)
+def policy_arrays(checkpoint):
+    import torch
+
+    with zipfile.ZipFile(checkpoint) as archive:
+        state = torch.load(io.BytesIO(archive.read("policy.pth")), map_location="cpu")
+
+    # layers in the order the forward pass runs them (older versions put shared layers before the policy layers)
+    layers = []
+    for prefix in ["mlp_extractor.shared_net.", "mlp_extractor.policy_net."]:
+        indices = sorted({int(key[len(prefix):].split(".")[0]) for key in state if key.startswith(prefix)})
+        layers += [f"{prefix}{i}" for i in indices]
+    layers.append("action_net")
+
+    arrays = {}
+    for i, layer in enumerate(layers):
+        arrays[f"w{i}"] = state[f"{layer}.weight"].numpy().T.astype(np.float32) # (inputs, outputs)
+        arrays[f"b{i}"] = state[f"{layer}.bias"].numpy().astype(np.float32)
+    return arrays
+
+# writes the policy network of a checkpoint to a .npz
+def export(path, out=None, activation="tanh"):
+    path = path[:-4] if path.endswith(".zip") else path
+    out = out or f"{path}.npz"
+    np.savez(out, activation=np.array(activation), **policy_arrays(f"{path}.zip"))
+    return out
+
+
+# deterministic (argmax) or sampled actions from the exported network, same interface as model.predict
+class NumpyPolicy:
+
+    def __init__(self, weights, biases, activation="tanh", seed=None):
+        self.weights = weights
+        self.biases = biases
+        self.activation = ACTIVATIONS[activation]
+        self.rng = np.random.default_rng(seed)
+
+    @classmethod
+    def load(cls, path, seed=None):
+        with np.load(path) as arrays:
+            return cls.from_arrays(dict(arrays), activation=str(arrays["activation"]), seed=seed)
+
+    # from policy_arrays (w0, b0, w1, b1, ...)
+    @classmethod
+    def from_arrays(cls, arrays, activation="tanh", seed=None):
+        layers = len([key for key in arrays if key.startswith("w")])
+        return cls([arrays[f"w{i}"] for i in range(layers)], [arrays[f"b{i}"] for i in range(layers)], activation=activation, seed=seed)
+
+    # action logits for a batch of observations
+    def logits(self, observations):
+        x = np.asarray(observations, dtype=np.float32)
+        for weight, bias in zip(self.weights[:-1], self.biases[:-1]):
+            x = self.activation(x @ weight + bias)
+        return x @ self.weights[-1] + self.biases[-1]
+
+    # action probabilities for a single observation or a batch
+    def probabilities(self, observation):
+        logits = self.logits(observation)
+        exp = np.exp(logits - logits.max(axis=-1, keepdims=True))
+        return exp / exp.sum(axis=-1, keepdims=True)
+
+    def predict(self, observation, state=None, episode_start=None, deterministic=False):
+        observation = np.asarray(observation, dtype=np.float32)
+        logits = self.logits(observation.reshape(-1, self.weights[0].shape[0]))
+        if not deterministic:
+            logits = logits - np.log(-np.log(self.rng.random(logits.shape))) # gumbel max samples from the softmax
+        actions = np.argmax(logits, axis=1)
+        return (np.array(actions[0]) if observation.ndim == 1 else actions), state
+
+
+# the observation (slide_x, slide_y, 3 scoring moves, 4 valid moves) only takes 2 * 2 * 5^3 * 2^4 = 8000 values
+# slide_x is 0 / 1, slide_y 2 / 3, scoring moves -1..3 and valid move i is either i or -1
+OBSERVATIONS = 8000
+
+OBSERVATION_STRIDES = np.array([4000, 2000, 400, 80, 16]) # slide_x, slide_y and scoring moves (valid moves are the low 4 bits)
+OBSERVATION_OFFSET = -2 * 2000 + 400 + 80 + 16 # slide_y starts at 2, scoring moves at -1
+VALID_BITS = np.array([1, 2, 4, 8])
+
+# table index of a single observation or a batch
+def observation_index(observation):
+    obs = np.asarray(observation).reshape(-1, 9)
+    return (obs[:, :5] @ OBSERVATION_STRIDES + OBSERVATION_OFFSET + (obs[:, 5:] >= 0) @ VALID_BITS).astype(np.int64)
+
+# every possible observation, row i has index i
+def all_observations():
+    index = np.arange(OBSERVATIONS)
+    valid = (index[:, None] >> np.arange(4)) & 1
+    rest = index // 16
+    scoring = np.stack([rest // 25 % 5, rest // 5 % 5, rest % 5], axis=1) - 1
+    slides = np.stack([rest // 250, rest // 125 % 2 + 2], axis=1)
+    return np.concatenate([slides, scoring, np.where(valid, np.arange(4), -1)], axis=1).astype(np.float32)
+
+# records a model's deterministic action (and action probabilities when it has them) for every observation
+def tabulate(model, out):
+    observations = all_observations()
+    arrays = dict(actions=np.asarray(model.predict(observations, deterministic=True)[0]).astype(np.uint8))
+    if hasattr(model, "probabilities"): # numpy policy
+        arrays["probabilities"] = model.probabilities(observations).astype(np.float32)
+    elif hasattr(model, "policy"): # stable baselines model
+        obs = model.policy.obs_to_tensor(observations)[0]
+        arrays["probabilities"] = model.policy.get_distribution(obs).distribution.probs.detach().cpu().numpy().astype(np.float32)
+    np.savez(out, **arrays)
+    return out
+
+
+# a tabulated model, every move is one lookup (deterministic=False samples from the recorded probabilities if there are any)
+class TablePolicy:
+
+    def __init__(self, actions, probabilities=None, seed=None):
+        self.actions = actions
+        self.cumulative = None if probabilities is None else np.cumsum(probabilities, axis=1)
+        self.rng = np.random.default_rng(seed)
+
+    @classmethod
+    def load(cls, path, seed=None):
+        with np.load(path) as arrays:
+            probabilities = arrays["probabilities"] if "probabilities" in arrays.files else None
+            return cls(arrays["actions"], probabilities, seed=seed)
+
+    def predict(self, observation, state=None, episode_start=None, deterministic=False):
+        observation = np.asarray(observation)
+        index = observation_index(observation)
+        if deterministic or self.cumulative is None:
+            actions = self.actions[index].astype(np.int64)
+        else:
+            cumulative = self.cumulative[index]
+            actions = np.minimum((self.rng.random((len(index), 1)) * cumulative[:, -1:] > cumulative).sum(axis=1), 3)
+        return (np.array(actions[0]) if observation.ndim == 1 else actions), state
+
+# loads an exported policy or a table (both are .npz)
+def load_policy(path, seed=None):
+    with np.load(path) as arrays:
+        table = "actions" in arrays.files
+    return TablePolicy.load(path, seed=seed) if table else NumpyPolicy.load(path, seed=seed)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="export a stable baselines3 PPO checkpoint to a numpy policy (.npz)")
+    parser.add_argument("model", help="checkpoint path, e.g. Agents/Agent-2940")
+    parser.add_argument("--out", help="defaults to the checkpoint path with .npz")
+    parser.add_argument("--activation", default="tanh", choices=list(ACTIVATIONS))
+    parser.add_argument("--table", action="store_true", help="tabulate the model instead (any checkpoint evaluate.py loads)")
+    args = parser.parse_args()
+
+    if args.table:
+        from evaluate import load_model
+        name = args.model.rpartition(":")[2]
+        name = name[:-4] if name.endswith((".zip", ".npz")) else name
+        print(tabulate(load_model(args.model), args.out or f"{name}.table.npz"))
+    else:
+        print(export(args.model, out=args.out, activation=args.activation))
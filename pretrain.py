@@ -0,0 +1,120 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from observations import MODES, model_mode
+from vec_env import VecEnv2048
+
+# expert games -> sharded (observation, action) datasets -> behavior cloning for a PPO MlpPolicy before fine-tuning
+# python pretrain.py data/expectimax --expert expectimax:10 --shards 64 --games 32
+# then train.train(model, ..., pretrain_data="data/expectimax") clones the expert before the PPO iterations
+
+MAX_STEPS = 20000 # expert games are cut off after this many moves
+
+# plays games with the expert and writes every (observation, action) pair of them to one shard
+# observation_mode is what the cloned policy will see (observations.py), experts that don't play from the grid need the same one
+def generate_shard(expert, path, games=32, size=4, seed=None, max_steps=MAX_STEPS, observation_mode="features"):
+    from evaluate import load_model
+
+    model = load_model(expert)
+    if not getattr(model, "uses_board", False) and model_mode(model, size) != observation_mode:
+        raise ValueError(f"{expert} takes {model_mode(model, size)} observations, not {observation_mode}")
+    env = VecEnv2048(games, size=size, seed=seed, auto_reset=False, observation_mode=observation_mode)
+    obs = env.reset()
+    live = np.ones(games, dtype=bool)
+    actions = np.zeros(games, dtype=np.int64)
+    observations, labels = [], []
+
+    while np.any(live) and env.states.max() < max_steps:
+        inputs = env.grids[live] if getattr(model, "uses_board", False) else obs[live]
+        actions[live] = np.asarray(model.predict(inputs, deterministic=True)[0]).reshape(-1)
+        observations.append(obs[live].copy())
+        labels.append(actions[live].astype(np.uint8))
+
+        reward, done, info = env.advance(actions)
+        obs = env.observation
+        live &= ~done
+
+    np.savez(path, observations=np.concatenate(observations), actions=np.concatenate(labels),
+             scores=env.score, max_tiles=env.grids.max(axis=(1, 2)))
+    return path
+
+# generates the shards of a dataset over a process pool (shards already on disk are kept, so it can resume)
+def generate(expert, directory, shards=64, games=32, size=4, n_workers=None, seed=0, observation_mode="features"):
+    os.makedirs(directory, exist_ok=True)
+    paths = [os.path.join(directory, f"shard-{i:05d}.npz") for i in range(shards)]
+    seeds = [int(child.generate_state(1)[0]) for child in np.random.SeedSequence(seed).spawn(shards)]
+    todo = [(path, shard_seed) for path, shard_seed in zip(paths, seeds) if not os.path.exists(path)]
+
+    with ProcessPoolExecutor(n_workers or os.cpu_count()) as pool:
+        futures = [pool.submit(generate_shard, expert, path, games, size, shard_seed, observation_mode=observation_mode)
+                   for path, shard_seed in todo]
+        for future in futures:
+            print(f"wrote {future.result()}")
+    return paths
+
+def shard_paths(directory):
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.startswith("shard-") and name.endswith(".npz"))
+
+# streams shuffled (observations, actions) minibatches, one shard in memory at a time
+def stream(directory, batch_size=256, epochs=1, seed=None):
+    rng = np.random.default_rng(seed)
+    paths = shard_paths(directory)
+    for epoch in range(epochs):
+        for path in rng.permutation(paths):
+            with np.load(path) as shard:
+                observations, actions = shard["observations"], shard["actions"].astype(np.int64)
+            order = rng.permutation(len(actions))
+            for start in range(0, len(order), batch_size):
+                index = order[start:start + batch_size]
+                yield observations[index], actions[index]
+
+# behavior cloning: maximizes the policy's log probability of the expert's actions (plus a little entropy)
+# works for PPO and MaskablePPO models, returns the mean loss and accuracy of every epoch
+def pretrain(model, directory, epochs=5, batch_size=256, learning_rate=1e-3, ent_coef=1e-3, seed=None, verbose=True):
+    import torch
+
+    policy = model.policy
+    optimizer = torch.optim.Adam(policy.parameters(), lr=learning_rate)
+    policy.set_training_mode(True)
+    history = []
+
+    for epoch in range(epochs):
+        losses, correct, total = [], 0, 0
+        for observations, actions in stream(directory, batch_size=batch_size, seed=None if seed is None else seed + epoch):
+            obs = torch.as_tensor(observations, device=policy.device)
+            act = torch.as_tensor(actions, device=policy.device)
+            values, log_prob, entropy = policy.evaluate_actions(obs, act)
+            loss = -log_prob.mean() - ent_coef * entropy.mean()
+
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+
+            losses.append(loss.item())
+            with torch.no_grad():
+                correct += (policy.get_distribution(obs).mode() == act).sum().item()
+            total += len(actions)
+
+        history.append((float(np.mean(losses)), correct / max(total, 1)))
+        if verbose:
+            print(f"pretrain epoch {epoch + 1}: loss {history[-1][0]:.4f}, accuracy {history[-1][1]:.2%}")
+
+    policy.set_training_mode(False)
+    return history
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="generate an expert dataset for behavior cloning")
+    parser.add_argument("out", help="directory for the shards, e.g. data/expectimax")
+    parser.add_argument("--expert", default="expectimax:10", help="anything evaluate.py loads, e.g. expectimax:10 or models/ntuple.npy")
+    parser.add_argument("--shards", type=int, default=64)
+    parser.add_argument("--games", type=int, default=32, help="games per shard")
+    parser.add_argument("--size", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--observation", default="features", choices=MODES, help="observation mode of the policy to clone into")
+    args = parser.parse_args()
+
+    generate(args.expert, args.out, shards=args.shards, games=args.games, size=args.size, n_workers=args.workers, seed=args.seed,
+             observation_mode=args.observation)
@@ -0,0 +1,79 @@
+import time
+from stable_baselines3.common.callbacks import BaseCallback
+
+# cumulative nanoseconds and call counts per phase of Env2048.step / reset (Env2048(profile=True))
+# phases are timed back to back: start() begins a call, every mark(phase) closes the phase that just ran
+class PhaseProfiler:
+
+    def __init__(self):
+        self.totals = {} # phase -> nanoseconds
+        self.calls = {} # phase -> times the phase ran
+        self.last = 0
+
+    def start(self):
+        self.last = time.perf_counter_ns()
+
+    def mark(self, phase):
+        now = time.perf_counter_ns()
+        self.totals[phase] = self.totals.get(phase, 0) + now - self.last
+        self.calls[phase] = self.calls.get(phase, 0) + 1
+        self.last = now
+
+    # {phase: (nanoseconds, calls)}
+    def stats(self):
+        return {phase: (total, self.calls[phase]) for phase, total in self.totals.items()}
+
+    def reset(self):
+        self.totals = {}
+        self.calls = {}
+
+# adds up the stats of several envs (e.g. every env of a vec env)
+def merge_stats(stats_list):
+    merged = {}
+    for stats in stats_list:
+        for phase, (total, calls) in stats.items():
+            old_total, old_calls = merged.get(phase, (0, 0))
+            merged[phase] = (old_total + total, old_calls + calls)
+    return merged
+
+# table of every phase with its share of the time spent in its method (step or reset)
+def format_profile(stats):
+    methods = {}
+    for phase, (total, calls) in stats.items():
+        method = phase.split(".")[0]
+        methods[method] = methods.get(method, 0) + total
+
+    lines = [f"{'phase':<24}{'calls':>10}{'total ms':>12}{'mean us':>10}{'share':>8}"]
+    for phase, (total, calls) in stats.items():
+        share = total / max(methods[phase.split(".")[0]], 1)
+        lines.append(f"{phase:<24}{calls:>10}{total / 1e6:>12.1f}{total / max(calls, 1) / 1000:>10.2f}{share:>8.1%}")
+    return "\n".join(lines)
+
+
+# logs the phase timings of every profiled env in the training env to TensorBoard (under profile/) after each rollout
+# the model's tensorboard_log / tb_log_name decide where they end up, next to the rest of the run
+class ProfileCallback(BaseCallback):
+
+    def __init__(self, verbose=0):
+        super(ProfileCallback, self).__init__(verbose)
+        self.previous = {}
+
+    def _on_step(self):
+        return True
+
+    def _on_rollout_end(self):
+        try:
+            profilers = self.training_env.get_attr("profiler")
+        except AttributeError: # env without per game profilers (e.g. VecEnv2048)
+            return
+        stats = merge_stats(profiler.stats() for profiler in profilers if profiler is not None)
+
+        # only the time spent since the last rollout (counters in the envs keep adding up)
+        for phase, (total, calls) in stats.items():
+            old_total, old_calls = self.previous.get(phase, (0, 0))
+            if calls > old_calls:
+                self.logger.record(f"profile/{phase}_us", (total - old_total) / (calls - old_calls) / 1000)
+        self.previous = stats
+
+        if self.verbose:
+            print(format_profile(stats))
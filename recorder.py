@@ -0,0 +1,152 @@
+import json
+import os
+import numpy as np
+
+# fixed width binary game records, written in append-only chunk files and read back memory-mapped (no parsing)
+# a recording is a directory with meta.json (board size, games so far) and chunk-000000.bin, chunk-000001.bin, ...
+# boards are stored as one uint8 exponent per cell (same as batch.py), so the reader's boards are ready (N, N) views
+# recorder = Recorder("runs/ppo", size=4)
+# env = Env2048(recorder=recorder) / Grid(recorder=recorder) / VecEnv2048(recorder=recorder), recorder.close() at the end
+# TrajectoryReader("runs/ppo").field("board") -> (transitions, 4, 4) uint8
+
+NO_SPAWN = 255 # spawn cell of moves that didn't change the board
+VERSION = 1
+
+# layout of one transition (the board is the one the action was taken on)
+def record_dtype(size):
+    return np.dtype([("board", np.uint8, (size, size)), ("action", np.uint8), ("moved", np.bool_),
+                     ("spawn_cell", np.uint8), ("spawn_exp", np.uint8), ("done", np.bool_),
+                     ("reward", np.float32), ("score", np.uint32), ("game", np.uint32), ("step", np.uint32)])
+
+
+class Recorder:
+
+    def __init__(self, path, size=4, chunk_records=1 << 20, buffer_records=4096):
+        self.path = path
+        self.size = size
+        self.dtype = record_dtype(size)
+        self.chunk_records = chunk_records # records per chunk file
+        self.buffer = np.zeros(buffer_records, dtype=self.dtype) # transitions waiting to be written
+        self.buffered = 0
+        os.makedirs(path, exist_ok=True)
+
+        # appending to an existing recording continues its last chunk and its game numbers
+        meta_path = os.path.join(path, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path) as file:
+                meta = json.load(file)
+            if meta["size"] != size:
+                raise ValueError(f"{path} records {meta['size']}x{meta['size']} games, not {size}x{size}")
+        else:
+            meta = dict(version=VERSION, size=size, games=0)
+        self.meta = meta
+        self.games = meta["games"]
+
+        chunks = chunk_paths(path)
+        self.chunk = len(chunks) - 1 if chunks else 0
+        self.file = None
+        self.open_chunk()
+
+    def open_chunk(self):
+        if self.file is not None:
+            self.file.close()
+        self.file = open(os.path.join(self.path, f"chunk-{self.chunk:06d}.bin"), "ab")
+        self.written = self.file.tell() // self.dtype.itemsize # records already in the chunk
+        self.file.truncate(self.written * self.dtype.itemsize) # drops a partial record left by a crash
+
+    # ids for new games (one per board for batched envs)
+    def new_games(self, count=1):
+        ids = np.arange(self.games, self.games + count)
+        self.games += int(count)
+        return ids
+
+    # adds transitions, every argument is an array over the transitions (or a value shared by all of them)
+    def append(self, board, action, moved, spawn_cell, spawn_exp, reward, score, game, step, done):
+        board = np.asarray(board, dtype=np.uint8).reshape(-1, self.size, self.size)
+        count = len(board)
+        fields = dict(board=board, action=action, moved=moved, spawn_cell=spawn_cell, spawn_exp=spawn_exp,
+                      reward=reward, score=score, game=game, step=step, done=done)
+
+        start = 0
+        while start < count:
+            n = min(count - start, len(self.buffer) - self.buffered)
+            records = self.buffer[self.buffered:self.buffered + n]
+            for name, value in fields.items():
+                value = np.asarray(value)
+                records[name] = value[start:start + n] if value.ndim and len(value) == count else value
+            self.buffered += n
+            start += n
+            if self.buffered == len(self.buffer):
+                self.flush()
+
+    # writes the buffered transitions, starting a new chunk whenever one is full
+    def flush(self):
+        start = 0
+        while start < self.buffered:
+            if self.written >= self.chunk_records:
+                self.chunk += 1
+                self.open_chunk()
+            n = min(self.buffered - start, self.chunk_records - self.written)
+            self.file.write(self.buffer[start:start + n].tobytes())
+            self.written += n
+            start += n
+        self.buffered = 0
+        self.file.flush()
+
+        self.meta["games"] = self.games
+        with open(os.path.join(self.path, "meta.json"), "w") as file:
+            json.dump(self.meta, file)
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def chunk_paths(path):
+    return sorted(os.path.join(path, name) for name in os.listdir(path) if name.startswith("chunk-") and name.endswith(".bin"))
+
+# memory-maps every chunk of a recording, every field comes back as a numpy view (or one concatenated array)
+class TrajectoryReader:
+
+    def __init__(self, path):
+        with open(os.path.join(path, "meta.json")) as file:
+            self.meta = json.load(file)
+        self.size = self.meta["size"]
+        self.dtype = record_dtype(self.size)
+
+        # a chunk that's still being written can end in a partial record, it's left out
+        self.chunks = []
+        for chunk in chunk_paths(path):
+            records = os.path.getsize(chunk) // self.dtype.itemsize
+            if records:
+                self.chunks.append(np.memmap(chunk, dtype=self.dtype, mode="r", shape=(records,)))
+        self.offsets = np.cumsum([0] + [len(chunk) for chunk in self.chunks])
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        chunk = np.searchsorted(self.offsets, index, side="right") - 1
+        return self.chunks[chunk][index - self.offsets[chunk]]
+
+    # views chunk by chunk
+    def __iter__(self):
+        return iter(self.chunks)
+
+    # one field of every transition (a view when there's a single chunk, otherwise concatenated)
+    def field(self, name):
+        if len(self.chunks) == 1:
+            return self.chunks[0][name]
+        return np.concatenate([chunk[name] for chunk in self.chunks]) if self.chunks else np.zeros(0, self.dtype[name])
+
+    # every transition of one game
+    def game(self, game):
+        return np.concatenate([chunk[chunk["game"] == game] for chunk in self.chunks])
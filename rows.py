@@ -0,0 +1,93 @@
+from collections import OrderedDict
+import numpy as np
+from batch import to_exponents, to_values
+from bitboard import merge_row
+
+# row transitions for grids of any size (5x5 to 7x7 rows have too many exponent combinations to enumerate up front)
+# a row of log2 exponents is encoded as its uint8 bytes and maps to the merged row and the score gained by a move to the right
+
+DEFAULT_MAX_ROWS = 1_000_000 # roughly 150-200 bytes per cached row in CPython
+
+class RowCache:
+
+    def __init__(self, max_rows=DEFAULT_MAX_ROWS):
+        self.max_rows = max_rows
+        self.rows = OrderedDict() # encoded row -> (encoded merged row, score), oldest use first
+        self.hits = 0
+        self.misses = 0
+
+    # merged row and score for an encoded row, filled in on first use
+    def lookup(self, key):
+        entry = self.rows.get(key)
+
+        # seen before (mark as most recently used)
+        if entry is not None:
+            self.hits += 1
+            self.rows.move_to_end(key)
+            return entry
+
+        # new row, merge it once and evict the least recently used rows past the cap
+        self.misses += 1
+        merged, score = merge_row(list(key))
+        entry = (bytes(merged), score)
+        self.rows[key] = entry
+        while len(self.rows) > self.max_rows:
+            self.rows.popitem(last=False)
+
+        return entry
+
+    # moves every row of an exponent matrix to the right, returns the new exponents and the score gained
+    def merge_rows(self, exps):
+        keys = [row.tobytes() for row in np.ascontiguousarray(exps, dtype=np.uint8)]
+        entries = [self.lookup(key) for key in keys]
+        merged = np.frombuffer(b"".join(entry[0] for entry in entries), dtype=np.uint8).reshape(exps.shape)
+        return merged, sum(entry[1] for entry in entries)
+
+    # changes the memory cap, evicting the oldest rows if needed
+    def resize(self, max_rows):
+        self.max_rows = max_rows
+        while len(self.rows) > self.max_rows:
+            self.rows.popitem(last=False)
+
+    def clear(self):
+        self.rows.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.rows)
+
+
+ROW_CACHE = RowCache() # shared by every move, find_valid_moves and score_maximizer call using the "table" engine
+
+# moves an exponent matrix in a direction using the cache, returns the new exponents and the score gained
+def merge(exps, direction, cache=ROW_CACHE):
+
+    # orient the grid so every move becomes a move to the right, then undo the orientation
+    if direction == "left":
+        merged, score = cache.merge_rows(exps[:, ::-1])
+        merged = merged[:, ::-1]
+    elif direction == "right":
+        merged, score = cache.merge_rows(exps)
+    elif direction == "up":
+        merged, score = cache.merge_rows(exps.T[:, ::-1])
+        merged = merged[:, ::-1].T
+    elif direction == "down":
+        merged, score = cache.merge_rows(exps.T)
+        merged = merged.T
+
+    return merged, score
+
+# same result as env.slide for a grid of any size (the grid after the move and the score gained, no new tile)
+def slide(grid, direction, cache=ROW_CACHE):
+    merged, score = merge(to_exponents(grid), direction, cache=cache)
+    return to_values(merged), score
+
+# same result as slide for all four moves (left, right, up, down), converting the grid only once
+def slide_all(grid, cache=ROW_CACHE):
+    exps = to_exponents(grid)
+    slides = []
+    for direction in ("left", "right", "up", "down"):
+        merged, score = merge(exps, direction, cache=cache)
+        slides.append((to_values(merged), score))
+    return slides
@@ -0,0 +1,190 @@
+import argparse
+import os
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import time
+import numpy as np
+
+# local inference server, loads a checkpoint once and answers many games at a time
+# requests that arrive within the latency window are stacked into one predict call (micro-batching)
+# python server.py Agents/Agent-2940.npz                        serves on 127.0.0.1:5048
+# python server.py models/ntuple.npy --address unix:/tmp/2048.sock
+# clients: PolicyClient(address) has the same predict as a model (main.py agent = "server", train.simulate,
+# evaluate.py "server:<address>")
+
+DEFAULT_ADDRESS = "127.0.0.1:5048"
+REQUEST = struct.Struct("<IIB") # rows, values per row, deterministic (then rows * values float32)
+RESPONSE = struct.Struct("<BI") # status (0 ok, 1 error), payload length (then int8 actions or an error message)
+
+# "unix:<path>" or "<host>:<port>"
+def parse_address(address):
+    if address.startswith("unix:"):
+        return socket.AF_UNIX, address[5:]
+    host, port = address.rsplit(":", 1)
+    return socket.AF_INET, (host, int(port))
+
+def recv_exact(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("connection closed")
+        data += chunk
+    return bytes(data)
+
+
+# collects requests from every connection and runs them through the model in batches
+class Batcher(threading.Thread):
+
+    def __init__(self, model, window=2, max_batch=1024):
+        threading.Thread.__init__(self, daemon=True)
+        self.model = model
+        self.uses_board = getattr(model, "uses_board", False) # rows are flattened grids instead of observations
+        self.window = window # milliseconds the first request of a batch waits for others
+        self.max_batch = max_batch # rows per batch
+        self.requests = queue.Queue() # (observations, deterministic, [result, done event])
+        self.batches = 0
+        self.rows = 0
+
+    # blocks until the batch with these observations went through the model, returns (status, payload)
+    def submit(self, observations, deterministic):
+        slot = [None, threading.Event()]
+        self.requests.put((observations, deterministic, slot))
+        slot[1].wait()
+        return slot[0]
+
+    def run(self):
+        while True:
+            batch = [self.requests.get()]
+            rows = len(batch[0][0])
+            deadline = time.perf_counter() + self.window / 1000
+
+            # keep collecting until the window closes or the batch is full
+            while rows < self.max_batch:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.requests.get(timeout=timeout))
+                except queue.Empty:
+                    break
+                rows += len(batch[-1][0])
+
+            # one predict per kind of request (deterministic or not, observation size)
+            groups = {}
+            for request in batch:
+                groups.setdefault((request[1], request[0].shape[1]), []).append(request)
+            for (deterministic, width), requests in groups.items():
+                self.predict(requests, deterministic, width)
+
+            self.batches += 1
+            self.rows += rows
+
+    def predict(self, requests, deterministic, width):
+        observations = np.concatenate([request[0] for request in requests])
+        if self.uses_board:
+            side = int(round(width ** 0.5))
+            observations = observations.reshape(-1, side, side)
+
+        try:
+            actions = np.asarray(self.model.predict(observations, deterministic=deterministic)[0]).reshape(-1).astype(np.int8)
+            results = [(0, part.tobytes()) for part in np.split(actions, np.cumsum([len(request[0]) for request in requests])[:-1])]
+        except Exception as error:
+            results = [(1, repr(error).encode())] * len(requests)
+
+        for (observations, deterministic, slot), result in zip(requests, results):
+            slot[0] = result
+            slot[1].set()
+
+
+# one thread per connection, every request goes through the shared batcher
+class Handler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        if self.request.family == socket.AF_INET:
+            self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        batcher = self.server.batcher
+        self.request.sendall(bytes([batcher.uses_board])) # tells the client whether to send grids or observations
+
+        while True:
+            try:
+                rows, width, deterministic = REQUEST.unpack(recv_exact(self.request, REQUEST.size))
+                observations = np.frombuffer(recv_exact(self.request, rows * width * 4), dtype=np.float32).reshape(rows, width)
+            except ConnectionError:
+                return
+            status, payload = batcher.submit(observations, bool(deterministic))
+            self.request.sendall(RESPONSE.pack(status, len(payload)) + payload)
+
+class TCPPolicyServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+class UnixPolicyServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+# builds a server for a loaded model (call serve_forever on it, or run it on a thread)
+def make_server(model, address=DEFAULT_ADDRESS, window=2, max_batch=1024):
+    family, target = parse_address(address)
+    if family == socket.AF_UNIX:
+        if os.path.exists(target):
+            os.remove(target) # stale socket from an earlier run
+        server = UnixPolicyServer(target, Handler)
+    else:
+        server = TCPPolicyServer(target, Handler)
+    server.batcher = Batcher(model, window=window, max_batch=max_batch)
+    server.batcher.start()
+    return server
+
+
+# connection to a policy server with the same predict as a model (thread safe, one request at a time)
+class PolicyClient:
+
+    def __init__(self, address=DEFAULT_ADDRESS):
+        family, target = parse_address(address)
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.connect(target)
+        if family == socket.AF_INET:
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.uses_board = bool(recv_exact(self.sock, 1)[0]) # the served agent plays from the grid
+        self.lock = threading.Lock()
+
+    # a single observation (or grid) or a batch
+    def predict(self, observation, state=None, episode_start=None, deterministic=False):
+        observation = np.asarray(observation, dtype=np.float32)
+        single = observation.ndim == (2 if self.uses_board else 1)
+        rows = observation.reshape(1 if single else len(observation), -1)
+
+        with self.lock:
+            self.sock.sendall(REQUEST.pack(len(rows), rows.shape[1], deterministic) + rows.tobytes())
+            status, length = RESPONSE.unpack(recv_exact(self.sock, RESPONSE.size))
+            payload = recv_exact(self.sock, length)
+        if status:
+            raise RuntimeError(f"policy server error: {payload.decode()}")
+
+        actions = np.frombuffer(payload, dtype=np.int8).astype(np.int64)
+        return (np.array(actions[0]) if single else actions), state
+
+    def close(self):
+        self.sock.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="serve a 2048 agent to many games at once")
+    parser.add_argument("model", help="checkpoint path (anything evaluate.py loads), e.g. Agents/Agent-2940.npz")
+    parser.add_argument("--address", default=DEFAULT_ADDRESS, help="<host>:<port> or unix:<path>")
+    parser.add_argument("--window", type=float, default=2, help="milliseconds to wait for more requests before a batch runs")
+    parser.add_argument("--max-batch", type=int, default=1024)
+    args = parser.parse_args()
+
+    from evaluate import load_model
+    server = make_server(load_model(args.model), address=args.address, window=args.window, max_batch=args.max_batch)
+    print(f"serving {args.model} on {args.address}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -47,4 +47,21 @@ CELL_NUMBER_FONTS = {
     512: ("Helvetica", 45, "bold"),
     1024: ("Helvetica", 40, "bold"),
     2048: ("Helvetica", 40, "bold")
-}
\ No newline at end of file
+}
+
+# tiles past 2048 (any power of two)
+SUPER_CELL_COLOR = "#3c3a32"
+SUPER_CELL_NUMBER_COLOR = "#ffffff"
+
+# (background, text color, font, text) of a tile value (0 is an empty cell)
+def cell_style(value):
+    if not value:
+        return EMPTY_CELL_COLOR, CELL_NUMBER_COLORS[2], CELL_NUMBER_FONTS[2], ""
+    if value in CELL_COLORS:
+        return CELL_COLORS[value], CELL_NUMBER_COLORS[value], CELL_NUMBER_FONTS[value], str(value)
+    # font shrinks with every extra digit so big tiles still fit the cell
+    font = ("Helvetica", max(40 - 6 * (len(str(value)) - 4), 16), "bold")
+    return SUPER_CELL_COLOR, SUPER_CELL_NUMBER_COLOR, font, str(value)
+
+# precomputed styles for empty cells and every tile up to 2^20 (cell_style covers anything bigger)
+CELL_STYLES = {value: cell_style(value) for value in [0] + [2 ** exp for exp in range(1, 21)]}
@@ -0,0 +1,194 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from checkpoint import write_file
+from evaluate import MAX_STEPS, play_chunk, summarize
+
+# evaluates every checkpoint matching some patterns on the same seeded games and ranks them
+# results go into an index keyed by the checkpoint's content hash and the evaluation settings, so a checkpoint
+# that didn't change is never played again (renamed or copied files hit the index too)
+# python sweep.py "models/Agent-*.zip" "Agents/*.npz" --games 1000
+# python sweep.py "maskable:models/Masked-*.zip" --plot sweep.png      (curves need matplotlib)
+
+INDEX = "sweeps/index.json"
+EXTENSIONS = (".zip", ".npz", ".npy") # what evaluate.load_model loads from a file
+STEP = re.compile(r"-(\d+)(?=\.|$)") # Agent-2940.zip, Agent-2940.table.npz
+BAR = 40 # characters of the longest bar in the text curves
+
+# sha256 of a file, read in chunks
+def file_hash(path, chunk=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(chunk), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+# training step in a checkpoint's name (None for names like Agent-best.zip)
+def step_of(path):
+    steps = STEP.findall(os.path.basename(path))
+    return int(steps[-1]) if steps else None
+
+# the pattern a checkpoint's run matches (its step replaced by *), checkpoints of one run share it
+def series_of(spec):
+    head, _, name = spec.rpartition("/")
+    name = STEP.sub("-*", name, count=1) if step_of(name) is not None else name
+    return f"{head}/{name}" if head else name
+
+# (spec, path) of every checkpoint matching the patterns, a "maskable:" prefix carries over to every match
+def checkpoints(patterns):
+    found = {}
+    for pattern in patterns:
+        loader, _, pattern = pattern.partition(":") if pattern.startswith("maskable:") else ("", "", pattern)
+        for path in glob.glob(pattern):
+            if path.endswith(EXTENSIONS) and os.path.isfile(path):
+                found[f"{loader}:{path}" if loader else path] = path
+    return sorted(found.items(), key=lambda item: (series_of(item[0]), step_of(item[1]) is None, step_of(item[1]) or 0))
+
+def load_index(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as file:
+        return json.load(file)
+
+def save_index(path, index):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    write_file(path, json.dumps(index, indent=1, sort_keys=True).encode()) # never leaves half an index behind
+
+# index key, the content hash and a hash of everything else that changes the result
+def result_key(digest, loader, settings):
+    encoded = json.dumps(dict(settings, loader=loader), sort_keys=True).encode()
+    return f"{digest}-{hashlib.sha256(encoded).hexdigest()[:16]}"
+
+# worker entry point, every checkpoint plays the same games (same seed)
+def evaluate_checkpoint(spec, games, size, seed, deterministic, max_steps):
+    start = time.perf_counter()
+    stats = play_chunk(spec, games, size, seed, deterministic, max_steps)
+    return json.loads(json.dumps(summarize(stats, time.perf_counter() - start))) # same keys as a report read back from the index
+
+# evaluates the checkpoints the index doesn't know yet (one process each), returns one row per checkpoint, best first
+def sweep(patterns, games=1000, size=4, seed=0, deterministic=True, max_steps=MAX_STEPS, n_workers=None, index_path=INDEX,
+          verbose=True):
+    index = load_index(index_path)
+    settings = dict(games=games, size=size, seed=seed, deterministic=deterministic, max_steps=max_steps)
+
+    rows, todo = [], {}
+    for spec, path in checkpoints(patterns):
+        digest = file_hash(path)
+        key = result_key(digest, spec[:-len(path)], settings)
+        rows.append(dict(checkpoint=spec, series=series_of(spec), step=step_of(path), key=key, cached=key in index))
+        if key not in index:
+            todo.setdefault(key, (spec, digest))
+
+    # every finished result is written right away, so an interrupted sweep keeps what it had
+    def store(key, report):
+        spec, digest = todo[key]
+        index[key] = dict(checkpoint=spec, sha256=digest, settings=settings, report=report)
+        save_index(index_path, index)
+        if verbose:
+            print(f"{spec}: mean score {report['score_mean']:.1f} ({report['seconds']:.1f}s)")
+
+    args = (games, size, seed, deterministic, max_steps)
+    if (n_workers or os.cpu_count()) > 1 and len(todo) > 1:
+        with ProcessPoolExecutor(min(n_workers or os.cpu_count(), len(todo))) as pool:
+            futures = {pool.submit(evaluate_checkpoint, spec, *args): key for key, (spec, digest) in todo.items()}
+            for future in as_completed(futures):
+                store(futures[future], future.result())
+    else:
+        for key, (spec, digest) in todo.items():
+            store(key, evaluate_checkpoint(spec, *args))
+
+    for row in rows:
+        row["report"] = index[row["key"]]["report"]
+    return sorted(rows, key=lambda row: -row["report"]["score_mean"])
+
+# share of games that reached a tile
+def reached(report, tile):
+    return report["reached"].get(str(tile), 0.0) # json keys are strings
+
+# ranked table of a sweep
+def format_table(rows, tile=2048):
+    header = f"{'rank':>4}  {'checkpoint':<40} {'step':>7} {'mean':>9} {'p50':>9} {'p95':>9} {f'>={tile}':>7} {'length':>8} {'invalid':>8}"
+    lines = [header]
+    for rank, row in enumerate(rows, 1):
+        report = row["report"]
+        step = "-" if row["step"] is None else row["step"]
+        lines.append(f"{rank:>4}  {row['checkpoint']:<40} {step:>7} {report['score_mean']:>9.1f} "
+                     f"{report['score_percentiles']['50']:>9.0f} {report['score_percentiles']['95']:>9.0f} "
+                     f"{reached(report, tile):>7.1%} {report['length_mean']:>8.1f} {report['invalid_rate']:>8.2%}")
+    return "\n".join(lines)
+
+# {series: rows in step order} (checkpoints without a step are left out)
+def curves(rows):
+    series = {}
+    for row in sorted((row for row in rows if row["step"] is not None), key=lambda row: row["step"]):
+        series.setdefault(row["series"], []).append(row)
+    return series
+
+# mean score against training step as text bars, one block per run
+def format_curves(rows):
+    series = curves(rows)
+    top = max([row["report"]["score_mean"] for runs in series.values() for row in runs] + [1])
+    lines = []
+    for name, runs in series.items():
+        lines.append(name)
+        for row in runs:
+            score = row["report"]["score_mean"]
+            lines.append(f"{row['step']:>9} {score:>9.1f} {'#' * int(round(BAR * score / top))}")
+    return "\n".join(lines)
+
+# mean score and 2048 rate against training step, one line per run (needs matplotlib)
+def plot(rows, out, tile=2048):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    figure, (score_axis, tile_axis) = plt.subplots(2, 1, sharex=True, figsize=(8, 7))
+    for name, runs in curves(rows).items():
+        steps = [row["step"] for row in runs]
+        score_axis.plot(steps, [row["report"]["score_mean"] for row in runs], marker="o", label=name)
+        tile_axis.plot(steps, [reached(row["report"], tile) for row in runs], marker="o", label=name)
+    score_axis.set_ylabel("mean score")
+    tile_axis.set_ylabel(f"reached {tile}")
+    tile_axis.set_xlabel("training step")
+    score_axis.legend()
+    figure.tight_layout()
+    figure.savefig(out)
+    return out
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="evaluate every checkpoint matching some patterns on the same games")
+    parser.add_argument("patterns", nargs="+", help="glob patterns, e.g. \"models/Agent-*.zip\" \"Agents/*.npz\" \"maskable:models/Masked-*.zip\"")
+    parser.add_argument("--games", type=int, default=1000)
+    parser.add_argument("--size", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--sample", action="store_true", help="sample actions instead of playing the most likely one")
+    parser.add_argument("--max-steps", type=int, default=MAX_STEPS)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--index", default=INDEX, help="result cache")
+    parser.add_argument("--plot", help="write the curves to an image (needs matplotlib)")
+    parser.add_argument("--json", action="store_true", help="print the rows as json")
+    args = parser.parse_args()
+
+    rows = sweep(args.patterns, games=args.games, size=args.size, seed=args.seed, deterministic=not args.sample,
+                 max_steps=args.max_steps, n_workers=args.workers, index_path=args.index)
+    if not rows:
+        raise SystemExit(f"no checkpoints match {' '.join(args.patterns)}")
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+    else:
+        print(format_table(rows))
+        if curves(rows):
+            print()
+            print(format_curves(rows))
+    if args.plot:
+        try:
+            print(f"wrote {plot(rows, args.plot)}")
+        except ImportError:
+            print("matplotlib isn't installed, skipped the plot")
@@ -1,30 +1,86 @@
+import io
+import os
 import stable_baselines3 as sb3
+from checkpoint import Checkpointer
 from env import Env2048
+from evaluate import evaluate, format_report, mask_kwargs
+from profiling import ProfileCallback
+from pretrain import pretrain
+from vec_env import VecEnv2048, SharedVecEnv2048
+
+ENVS_PER_WORKER = 16 # boards each worker process steps when training on multiple cores
+
+# moves a model onto boards stepped by worker processes (PPO's rollout buffer depends on the number of envs, so it gets reloaded)
+def parallelize(model, n_workers, n_envs=None):
+    size, mode = model.get_env().get_attr("size")[0], model.get_env().get_attr("observation_mode")[0]
+    env = SharedVecEnv2048(n_envs or n_workers * ENVS_PER_WORKER, size=size, n_workers=n_workers, observation_mode=mode)
+    buffer = io.BytesIO()
+    model.save(buffer)
+    buffer.seek(0)
+    return type(model).load(buffer, env=env)
+
+# PPO that only samples valid moves, the masks come from env.action_masks() (needs sb3_contrib)
+# works with Env2048 and both batched envs, MaskablePPO models train, retrain (masked=True) and parallelize like PPO ones
+def masked_model(env, verbose=1, tensorboard_log="logs/", **kwargs):
+    from sb3_contrib import MaskablePPO
+    return MaskablePPO("MlpPolicy", env, verbose=verbose, tensorboard_log=tensorboard_log, **kwargs)
 
 # trains model over certain amount of time steps, logs after n time steps, does this N iterations
-def train(model, log_name, timesteps=10000, iters=100):
+# n_workers > 1 steps the games on that many processes, callback is passed to every learn call (e.g. ProfileCallback())
+# pretrain_data (a directory of expert shards from pretrain.py) clones the expert first, PPO fine-tunes from there
+# checkpoints are written in the background with retention (pass a Checkpointer for other retention / keep-best settings)
+def train(model, log_name, timesteps=10000, iters=100, n_workers=1, n_envs=None, callback=None, pretrain_data=None, pretrain_epochs=5,
+          checkpointer=None):
+    checkpointer = checkpointer or Checkpointer(log_name)
+    if pretrain_data:
+        pretrain(model, pretrain_data, epochs=pretrain_epochs)
+        checkpointer.save(model, 0)
+
+    if n_workers > 1:
+        model = parallelize(model, n_workers, n_envs=n_envs)
+
     for i in range(1, iters + 1):
-        model.learn(total_timesteps=timesteps, reset_num_timesteps=False, tb_log_name=log_name)
-        model.save(f"models/{log_name}-{i}")
+        model.learn(total_timesteps=timesteps, reset_num_timesteps=False, tb_log_name=log_name, callback=callback)
+        checkpointer.save(model, i)
 
-# for retraining an already trained model
-def retrain(env, log_name, timesteps, iters):
+    checkpointer.close() # waits for the last checkpoints
+    return model
+
+# for retraining an already trained model (n_workers > 1 steps the games on that many processes)
+# masked=True for models trained with masked_model
+def retrain(env, log_name, timesteps, iters, n_workers=1, n_envs=None, callback=None, masked=False, checkpointer=None):
     name, steps = log_name.split('-') # get name of model, time steps
-    model = sb3.PPO.load(f'models/{log_name}') # load model
-    model.set_env(env, force_reset=True)
+    checkpointer = checkpointer or Checkpointer(name)
+    if masked:
+        from sb3_contrib import MaskablePPO as algorithm
+    else:
+        algorithm = sb3.PPO
+
+    # load model
+    if n_workers > 1:
+        env = SharedVecEnv2048(n_envs or n_workers * ENVS_PER_WORKER, size=env.size, n_workers=n_workers,
+                               observation_mode=env.observation_mode)
+        model = algorithm.load(f'models/{log_name}', env=env)
+    else:
+        model = algorithm.load(f'models/{log_name}')
+        model.set_env(env, force_reset=True)
 
     # retrain the model (continuing from previous)
     for i in range(1, iters + 1):
-        model.learn(total_timesteps=timesteps, reset_num_timesteps=False, tb_log_name=log_name)
-        model.save(f"models/{name}-{int(steps) + i}")
+        model.learn(total_timesteps=timesteps, reset_num_timesteps=False, tb_log_name=log_name, callback=callback)
+        checkpointer.save(model, int(steps) + i)
+
+    checkpointer.close() # waits for the last checkpoints
+    return model
 
 # simulates how the model peforms after desired episode length
-def simulate(model, env, tile, episodes=3, verbose=False):
+# model can also be a server.PolicyClient, a seed replays the same games every call (use Env2048(spawn_stream=True) so different models see the same tiles)
+def simulate(model, env, tile, episodes=3, verbose=False, seed=None):
     total = 0
     # create new sim for n episodes
     for ep in range(episodes):
         done = False
-        obs = env.reset() # init
+        obs = env.reset(seed=None if seed is None else seed + ep) # init
 
         # show info & env
         if verbose:
@@ -34,8 +90,9 @@ def simulate(model, env, tile, episodes=3, verbose=False):
         # run sim until the agent is done (fails or wins)
         while not done:
 
-            # predict based on env, then update env
-            action, state = model.predict(obs)
+            # predict based on env (maskable models only pick valid moves, search agents play from the grid), then update env
+            inputs = env.grid if getattr(model, "uses_board", False) else obs
+            action, state = model.predict(inputs, **mask_kwargs(model, env.action_masks()))
             obs, reward, done, info = env.step(action)
             # tile number reached during episode
             if info["points"] >= tile:
@@ -56,15 +113,32 @@ if __name__ == "__main__":
     env = Env2048(size=4) # 4x4 2048 env
 
     # TRAINING
+    # env = VecEnv2048(n_envs=256, size=4) # batched 4x4 boards, same rewards and observations (much faster rollouts)
+    # env = VecEnv2048(n_envs=256, size=4, observation_mode="onehot") # the board itself instead of the 9 features ("log2" also works)
     # model = sb3.PPO("MlpPolicy", env, verbose=1, tensorboard_log="logs/") # Proximal Policy Optimization Algorithm
     # train(model, log_name="Agent", timesteps=10000, iters=5000) # 50 million runs in the game
+    # train(model, log_name="Agent", timesteps=10000, iters=5000, checkpointer=Checkpointer("Agent", keep_last=10, keep_every=500, eval_every=25)) # keeps models/Agent-best.zip
+    # train(model, log_name="Agent", timesteps=10000, iters=5000, n_workers=8) # same on 8 worker processes
+    # model = sb3.PPO("MlpPolicy", Env2048(size=4, profile=True), verbose=1, tensorboard_log="logs/") # time every phase of step / reset (logged under profile/ in TensorBoard)
+    # train(model, log_name="Agent", timesteps=10000, iters=5000, callback=ProfileCallback())
+    # python pretrain.py data/expectimax --expert expectimax:10 # expert games for behavior cloning
+    # train(model, log_name="Pretrained", timesteps=10000, iters=500, pretrain_data="data/expectimax") # clone, then fine-tune
+    # model = masked_model(VecEnv2048(n_envs=256, size=4)) # never samples an invalid move (evaluate with "maskable:models/...")
+    # train(model, log_name="Masked", timesteps=10000, iters=5000)
     
     # RETRAINING
     # ppo = sb3.PPO.load("models/ppo_4x4-100x10^4")
     # retrain(env, "ppo-6824", timesteps=10000, iters=5000)
 
-    # SIMULATING
+    # SIMULATING (one game at a time, verbose=True to watch it)
     tag = 2940
-    model = sb3.PPO.load(f"Agents/Agent-{tag}")
-    total = simulate(model, env, points=1024, episodes=1000)
-    print(total)
\ No newline at end of file
+    # model = sb3.PPO.load(f"Agents/Agent-{tag}")
+    # total = simulate(model, env, tile=1024, episodes=1000)
+    # print(total)
+
+    # SWEEPING (every checkpoint of a run on the same games, results cached by content hash in sweeps/index.json)
+    # python sweep.py "models/Agent-*.zip" "Agents/*.npz" --games 1000 --plot sweep.png
+
+    # EVALUATING (many games at once on every core)
+    report = evaluate(f"Agents/Agent-{tag}.npz", games=10000, size=4, n_workers=os.cpu_count()) # exported policy (policy.py), same actions without torch
+    print(format_report(report))
\ No newline at end of file
@@ -0,0 +1,325 @@
+import multiprocessing as mp
+import numpy as np
+from gym import spaces
+from stable_baselines3.common.vec_env import VecEnv
+import batch
+from env import MAPPINGS
+from observations import encode, observation_space
+from recorder import NO_SPAWN
+
+GOALS = ["top-left", "bot-left", "top-right", "bot-right"] # quadrant names (same as env.find_goal_space)
+SLIDES = np.array([[0, 2], [0, 3], [1, 2], [1, 3]]) # slide_x, slide_y for every quadrant (same as env.slide_to)
+SCALE = 100 # reward scale (same as Env2048)
+
+# many Env2048 games stepped together, every board lives in one (B, N, N) array of exponents
+class VecEnv2048(VecEnv):
+
+    def __init__(self, n_envs=256, size=4, seed=None, auto_reset=True, recorder=None, observation_mode="features"):
+        self.size = size
+        self.auto_reset = auto_reset # finished games restart on the next step (off keeps the final boards, e.g. for evaluation)
+        self.observation_mode = observation_mode # same modes as Env2048 (observations.py)
+        super(VecEnv2048, self).__init__(n_envs, observation_space(observation_mode, size), spaces.Discrete(4))
+        self.rng = np.random.default_rng(seed)
+        self.index = np.arange(n_envs)
+        self.actions = np.zeros(n_envs, dtype=np.int64)
+
+        # game info for every board
+        self.boards = np.zeros((n_envs, size, size), dtype=np.uint8)
+        self.score = np.zeros(n_envs, dtype=np.int64)
+        self.states = np.zeros(n_envs, dtype=np.int64)
+        self.moves = np.zeros(n_envs, dtype=np.int64)
+        self.goal = np.zeros(n_envs, dtype=np.int64)
+        self.slide_x = np.zeros(n_envs, dtype=np.int64)
+        self.slide_y = np.zeros(n_envs, dtype=np.int64)
+        self.worst_move = np.zeros(n_envs, dtype=np.int64)
+        self.valid_moves = np.full((n_envs, 4), -1, dtype=np.int64)
+        self.scoring_moves = np.full((n_envs, 3), -1, dtype=np.int64)
+        self.observation = np.zeros((n_envs,) + self.observation_space.shape, dtype=np.float32) # written in place every step
+
+        # afterstates of the current boards (4, B, N, N), shared by the valid moves, scoring moves and the next step
+        self.after = np.zeros((4, n_envs, size, size), dtype=np.uint8)
+        self.after_scores = np.zeros((4, n_envs), dtype=np.int64)
+        self.after_moved = np.zeros((4, n_envs), dtype=bool)
+
+        # recorder.Recorder that gets every board's transitions (None records nothing)
+        self.recorder = recorder
+        self.game_ids = np.zeros(n_envs, dtype=np.int64)
+
+    # tile values of every board
+    @property
+    def grids(self):
+        return batch.to_values(self.boards)
+
+    # starts new games on the selected boards
+    def reset_boards(self, mask):
+        self.boards[mask] = 0
+        batch.populate(self.boards, self.rng, mask=mask, start=True)
+        batch.populate(self.boards, self.rng, mask=mask, start=True)
+
+        if self.recorder is not None:
+            self.game_ids[mask] = self.recorder.new_games(np.count_nonzero(mask))
+        self.score[mask] = 0
+        self.states[mask] = 0
+        self.moves[mask] = 0
+        self.goal[mask] = batch.find_goal_space(self.boards[mask])
+        self.slide_x[mask], self.slide_y[mask] = SLIDES[self.goal[mask]].T
+        self.worst_move[mask] = np.where(self.slide_x[mask] == 0, 1, 0)
+        self.observe(mask)
+
+    # recomputes the afterstates, valid moves, scoring moves and observations of the selected boards
+    def observe(self, mask):
+        after, scores, moved = batch.afterstates(self.boards[mask])
+        self.after[:, mask], self.after_scores[:, mask], self.after_moved[:, mask] = after, scores, moved
+        self.valid_moves[mask] = batch.find_valid_moves(moved)
+        self.scoring_moves[mask] = batch.score_maximizer(self.slide_x[mask], self.slide_y[mask], scores)
+
+        # every board is observed after a step (written straight into the buffer), only restarted boards after a reset
+        if self.observation_mode == "features":
+            self.observation[mask, 0] = self.slide_x[mask]
+            self.observation[mask, 1] = self.slide_y[mask]
+            self.observation[mask, 2:5] = self.scoring_moves[mask]
+            self.observation[mask, 5:] = self.valid_moves[mask]
+        elif mask.all():
+            encode(self.boards, self.observation_mode, out=self.observation)
+        else:
+            self.observation[mask] = encode(self.boards[mask], self.observation_mode)
+
+    def reset(self):
+        self.reset_boards(np.ones(self.num_envs, dtype=bool))
+        return self.observation.copy()
+
+    # moves that change each board (B, 4), same as Env2048.action_masks
+    def action_masks(self):
+        return self.valid_moves >= 0
+
+    def step_async(self, actions):
+        self.actions = np.asarray(actions, dtype=np.int64).reshape(self.num_envs)
+
+    # steps every board, returns the rewards, dones and per board game info as arrays (finished games restart if auto_reset)
+    def advance(self, action):
+        scoring_moves = self.scoring_moves.copy()
+
+        # make the moves from the cached afterstates, only boards that moved get a new tile
+        previous = self.boards
+        moved = self.after_moved[action, self.index]
+        gained = self.after_scores[action, self.index]
+        self.boards = self.after[action, self.index].copy()
+        empty = self.boards == 0 if self.recorder is not None else None # to find where the new tiles land
+        batch.populate(self.boards, self.rng, mask=moved)
+
+        # update game info
+        self.states += 1
+        self.score += gained
+        self.moves += moved
+        grid_sum = batch.to_values(self.boards).sum(axis=(1, 2))
+        discount = 1 / (np.sqrt(np.log(self.states) + 1) * SCALE)
+
+        # same reward shaping as Env2048.step
+        best_move, med_move, least_move = scoring_moves.T
+        alternatives = self.valid_moves.sum(axis=1) - self.valid_moves[self.index, self.worst_move] != -3
+        bonus = np.select([action == best_move, action == med_move, action == least_move, action == self.slide_x,
+                           action == self.slide_y, action > 1, alternatives], [200, 150, 100, 75, 50, 25, -100], 0)
+        reward = np.where(moved, gained + grid_sum / 10 + bonus, -100.0) * discount
+
+        # checking if the games are over
+        done = batch.game_over(self.boards)
+        reward[done] = 0
+
+        info = dict(states=self.states.copy(), score=self.score.copy(), points=gained, moved=moved,
+                    scoring_moves=scoring_moves, total=grid_sum, goal=self.goal.copy(), discount=discount)
+
+        if self.recorder is not None:
+            spawned = (empty & (self.boards != 0)).reshape(self.num_envs, -1)
+            spawn_cell = np.where(moved, spawned.argmax(axis=1), NO_SPAWN)
+            spawn_exp = np.where(moved, self.boards.reshape(self.num_envs, -1)[self.index, spawned.argmax(axis=1)], 0)
+            self.recorder.append(previous, action, moved, spawn_cell, spawn_exp, reward, self.score, self.game_ids,
+                                 self.states - 1, done)
+
+        # get observations for the next step, keep the last observation of finished games before restarting them
+        self.observe(np.ones(self.num_envs, dtype=bool))
+        info["terminal_observation"] = self.observation[done].copy()
+        if self.auto_reset and np.any(done):
+            self.reset_boards(done)
+
+        return reward, done, info
+
+    def step_wait(self):
+        reward, done, info = self.advance(self.actions)
+        scoring_moves = info["scoring_moves"]
+
+        infos = [dict(states=info["states"][i], score=info["score"][i], points=info["points"][i],
+                      moved="yes" if info["moved"][i] else "no", best_move=MAPPINGS.get(scoring_moves[i, 0], "NA"),
+                      next_best=MAPPINGS.get(scoring_moves[i, 1], "NA"), total=info["total"][i],
+                      target=GOALS[info["goal"][i]], discount=info["discount"][i]) for i in self.index]
+        for i, observation in zip(np.flatnonzero(done), info["terminal_observation"]):
+            infos[i]["terminal_observation"] = observation
+
+        return self.observation.copy(), reward.astype(np.float32), done, infos
+
+    def seed(self, seed=None):
+        self.rng = np.random.default_rng(seed)
+        return [seed] * self.num_envs
+
+    def close(self):
+        pass
+
+    # per board attributes come back per env, anything else is shared by every env
+    def get_attr(self, attr_name, indices=None):
+        value = getattr(self, attr_name)
+        indices = self._get_indices(indices)
+        if isinstance(value, np.ndarray) and value.shape[:1] == (self.num_envs,):
+            return [value[i] for i in indices]
+        return [value for _ in indices]
+
+    def set_attr(self, attr_name, value, indices=None):
+        current = getattr(self, attr_name)
+        if isinstance(current, np.ndarray) and current.shape[:1] == (self.num_envs,):
+            current[self._get_indices(indices)] = value
+        else:
+            setattr(self, attr_name, value)
+
+    # only action_masks has a per env version (what sb3_contrib's MaskablePPO calls)
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        if method_name == "action_masks":
+            return list(self.action_masks()[self._get_indices(indices)])
+        raise NotImplementedError(f"VecEnv2048 has no per env method {method_name}")
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return [False for _ in self._get_indices(indices)]
+
+
+# numpy views over the shared buffers (same layout in the main process and the workers)
+def shared_views(buffers, n_envs, width):
+    actions, observations, rewards, dones, scores, terminal, masks = buffers
+    return (np.frombuffer(actions, dtype=np.int64), np.frombuffer(observations, dtype=np.float32).reshape(n_envs, width),
+            np.frombuffer(rewards, dtype=np.float32), np.frombuffer(dones, dtype=np.bool_),
+            np.frombuffer(scores, dtype=np.int64), np.frombuffer(terminal, dtype=np.float32).reshape(n_envs, width),
+            np.frombuffer(masks, dtype=np.bool_).reshape(n_envs, 4))
+
+# worker process loop, steps boards [start, stop) and writes the results straight into the shared buffers
+def shared_worker(conn, buffers, n_envs, start, stop, size, seed, observation_mode):
+    env = VecEnv2048(stop - start, size=size, seed=seed, observation_mode=observation_mode)
+    actions, observations, rewards, dones, scores, terminal, masks = shared_views(buffers, n_envs, env.observation.shape[1])
+
+    while True:
+        command = conn.recv_bytes()
+
+        if command == b"step":
+            reward, done, info = env.advance(actions[start:stop])
+            rewards[start:stop] = reward
+            dones[start:stop] = done
+            scores[start:stop] = info["score"]
+            terminal[start:stop][done] = info["terminal_observation"]
+            observations[start:stop] = env.observation
+            masks[start:stop] = env.action_masks()
+
+        elif command == b"reset":
+            observations[start:stop] = env.reset()
+            masks[start:stop] = env.action_masks()
+
+        elif command.startswith(b"seed:"):
+            env.seed(int(command[5:]))
+
+        elif command == b"close":
+            conn.send_bytes(b"ok")
+            break
+
+        conn.send_bytes(b"ok") # only a tiny acknowledgement goes through the pipe
+
+
+# VecEnv2048 split over worker processes, every worker steps its own group of boards
+# actions, observations, rewards and dones live in shared memory so nothing is pickled per step
+class SharedVecEnv2048(VecEnv):
+
+    def __init__(self, n_envs=256, size=4, n_workers=None, seed=None, start_method=None, observation_mode="features"):
+        self.size = size
+        self.n_workers = min(n_workers or mp.cpu_count(), n_envs)
+        self.observation_mode = observation_mode
+        super(SharedVecEnv2048, self).__init__(n_envs, observation_space(observation_mode, size), spaces.Discrete(4))
+        width = self.observation_space.shape[0]
+
+        # same default start method as stable baselines' SubprocVecEnv
+        if start_method is None:
+            start_method = "forkserver" if "forkserver" in mp.get_all_start_methods() else "spawn"
+        ctx = mp.get_context(start_method)
+
+        # shared buffers (actions, observations, rewards, dones, scores, terminal observations, action masks)
+        self.buffers = (ctx.RawArray("b", n_envs * 8), ctx.RawArray("b", n_envs * width * 4), ctx.RawArray("b", n_envs * 4),
+                        ctx.RawArray("b", n_envs), ctx.RawArray("b", n_envs * 8), ctx.RawArray("b", n_envs * width * 4),
+                        ctx.RawArray("b", n_envs * 4))
+        (self.actions, self.observations, self.rewards, self.dones, self.scores, self.terminal,
+         self.masks) = shared_views(self.buffers, n_envs, width)
+
+        # disjoint groups of boards, one per worker
+        bounds = np.linspace(0, n_envs, self.n_workers + 1).astype(int)
+        seeds = np.random.SeedSequence(seed).spawn(self.n_workers)
+        self.conns, self.processes = [], []
+        for start, stop, worker_seed in zip(bounds[:-1], bounds[1:], seeds):
+            conn, worker_conn = ctx.Pipe()
+            args = (worker_conn, self.buffers, n_envs, start, stop, size, worker_seed, observation_mode)
+            process = ctx.Process(target=shared_worker, args=args, daemon=True)
+            process.start()
+            worker_conn.close()
+            self.conns.append(conn)
+            self.processes.append(process)
+        self.closed = False
+
+    # sends a command to every worker and waits for all of them to finish
+    def command(self, command):
+        for conn in self.conns:
+            conn.send_bytes(command)
+        for conn in self.conns:
+            conn.recv_bytes()
+
+    def reset(self):
+        self.command(b"reset")
+        return self.observations.copy()
+
+    def step_async(self, actions):
+        self.actions[:] = np.asarray(actions).reshape(self.num_envs)
+        for conn in self.conns:
+            conn.send_bytes(b"step")
+
+    def step_wait(self):
+        for conn in self.conns:
+            conn.recv_bytes()
+
+        infos = [dict(score=score) for score in self.scores]
+        for i in np.flatnonzero(self.dones):
+            infos[i]["terminal_observation"] = self.terminal[i].copy()
+
+        return self.observations.copy(), self.rewards.copy(), self.dones.copy(), infos
+
+    # moves that change each board (B, 4), written by the workers next to the observations
+    def action_masks(self):
+        return self.masks.copy()
+
+    # reseeds every worker with its own child seed
+    def seed(self, seed=None):
+        for conn, child in zip(self.conns, np.random.SeedSequence(seed).spawn(self.n_workers)):
+            conn.send_bytes(b"seed:" + str(child.generate_state(1)[0]).encode())
+        for conn in self.conns:
+            conn.recv_bytes()
+        return [seed] * self.num_envs
+
+    def close(self):
+        if self.closed:
+            return
+        self.command(b"close")
+        for process in self.processes:
+            process.join()
+        self.closed = True
+
+    def get_attr(self, attr_name, indices=None):
+        return [getattr(self, attr_name) for _ in self._get_indices(indices)]
+
+    def set_attr(self, attr_name, value, indices=None):
+        setattr(self, attr_name, value)
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        if method_name == "action_masks":
+            return list(self.action_masks()[self._get_indices(indices)])
+        raise NotImplementedError(f"SharedVecEnv2048 has no per env method {method_name}")
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return [False for _ in self._get_indices(indices)]